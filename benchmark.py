@@ -0,0 +1,312 @@
+"""Benchmark ``process_data`` and ``bindingcalculator`` on synthetic data.
+
+Synthetic studies at a configurable scale are written in the same layout as
+the real ``data/<study>/study.yml`` and ``data.csv`` files along with a matching
+calculator input CSV, and then the hot paths are timed and their peak memory
+recorded. Results are written as JSON, and can be compared to those of an
+earlier run with ``--compare``.
+
+"""
+
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import pandas as pd
+
+import bindingcalculator
+import process_data
+
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def write_synthetic_data(outdir,
+                         *,
+                         n_studies=5,
+                         n_conditions=20,
+                         n_sites=201,
+                         n_mutations=19,
+                         seed=0,
+                         ):
+    """Write synthetic escape data.
+
+    Writes ``data/<study>/study.yml`` and ``data.csv`` for each study, the
+    ``docs`` files that :func:`process_data.process_data` adds citations to,
+    and ``escape_calculator_data.csv`` for :class:`bindingcalculator.BindingCalculator`,
+    all in `outdir`.
+
+    Parameters
+    ----------
+    outdir : str
+        Directory in which data are written.
+    n_studies : int
+        Number of studies.
+    n_conditions : int
+        Number of conditions (antibodies) per study.
+    n_sites : int
+        Number of sites, numbered from 331.
+    n_mutations : int
+        Number of mutations per site, at most 19.
+    seed : int
+        Random number seed.
+
+    Returns
+    -------
+    str
+        Path of the calculator input CSV.
+
+    """
+    if not 1 <= n_mutations < len(AMINO_ACIDS):
+        raise ValueError(f"invalid {n_mutations=}")
+    rng = np.random.default_rng(seed)
+    sites = np.arange(331, 331 + n_sites)
+    wildtypes = np.array([AMINO_ACIDS[site % len(AMINO_ACIDS)] for site in sites])
+    # each site has the `n_mutations` amino acids following its wildtype
+    mutations = np.array([
+        [AMINO_ACIDS[(site + i) % len(AMINO_ACIDS)] for i in range(1, n_mutations + 1)]
+        for site in sites
+    ])
+
+    for istudy in range(n_studies):
+        first_author = f"Synthetic{istudy}"
+        study = f"2022_{first_author}_benchmark"
+        os.makedirs(os.path.join(outdir, 'data', study), exist_ok=True)
+        with open(os.path.join(outdir, 'data', study, 'study.yml'), 'w') as f:
+            f.write(f"study_title: Synthetic benchmark study {istudy}\n\n"
+                    f"study_first_author: {first_author}\n\n"
+                    "study_year: 2022\n\n"
+                    "study_journal: Synthetic\n\n"
+                    f"study_url: https://example.org/{study}\n\n"
+                    "lab: Bloom_JD\n\n"
+                    "conditions:\n")
+            for icondition in range(n_conditions):
+                f.write(f"  S{istudy}-Ab{icondition}:\n"
+                        "    type: antibody\n"
+                        f"    subtype: class {icondition % 4 + 1}\n"
+                        "    year: 2021\n"
+                        "    known_to_neutralize:\n"
+                        f"      - [Wuhan-Hu-1, {rng.uniform(0.001, 1):.3g}]\n")
+        n_rows = n_sites * n_mutations
+        # most mutations have no escape, and escape is concentrated at a few sites
+        site_escape = rng.exponential(0.05, (n_conditions, n_sites)) ** 2
+        data = pd.DataFrame({
+            'condition': np.repeat([f"S{istudy}-Ab{i}" for i in range(n_conditions)], n_rows),
+            'site': np.tile(np.repeat(sites, n_mutations), n_conditions),
+            'wildtype': np.tile(np.repeat(wildtypes, n_mutations), n_conditions),
+            'mutation': np.tile(mutations.ravel(), n_conditions),
+            'mut_escape': (
+                np.repeat(site_escape, n_mutations, axis=1).ravel()
+                * rng.exponential(1, n_conditions * n_rows)
+                * (rng.random(n_conditions * n_rows) < 0.5)
+            ),
+        })
+        data.to_csv(os.path.join(outdir, 'data', study, 'data.csv'),
+                    index=False, float_format='%.4g')
+
+    os.makedirs(os.path.join(outdir, 'docs'), exist_ok=True)
+    for md in ['index.md', 'escape-calc.md']:
+        with open(os.path.join(outdir, 'docs', md), 'w') as f:
+            f.write('# Synthetic benchmark data\n\n## Citations\n')
+
+    # calculator data: each condition has escape at a random subset of sites
+    rows = []
+    for icondition in range(n_studies * n_conditions):
+        ic50s = rng.uniform(0.5, 4, 2)
+        if icondition % 2:
+            known_to_neutralize = 'Wuhan-Hu-1;BA.1;any'
+            neg_log_IC50 = ';'.join(f"{x:.3g}" for x in [*ic50s, ic50s.min()])
+        else:
+            known_to_neutralize = 'Wuhan-Hu-1;any'
+            neg_log_IC50 = f"{ic50s[0]:.3g};{ic50s[0]:.3g}"
+        condition_sites = rng.choice(sites, max(1, n_sites // 10), replace=False)
+        rows.append(pd.DataFrame({
+            'condition': f"Ab{icondition}",
+            'site': np.sort(condition_sites),
+            'escape': rng.exponential(0.3, len(condition_sites)),
+            'eliciting_virus': 'SARS-CoV-2;pre-Omicron SARS-CoV-2',
+            'known_to_neutralize': known_to_neutralize,
+            'neg_log_IC50': neg_log_IC50,
+        }))
+    calculator_csv = os.path.join(outdir, 'escape_calculator_data.csv')
+    pd.concat(rows).to_csv(calculator_csv, index=False)
+    return calculator_csv
+
+
+def measure(func, repeat=3):
+    """Time calls to `func` and measure peak memory allocated during one call.
+
+    Timing runs do not trace memory so that tracing overhead does not
+    affect the times.
+
+    Returns
+    -------
+    dict
+        Keyed by 'seconds' (median time), 'min_seconds', 'repeat', and
+        'peak_memory_mb' (peak memory traced by :mod:`tracemalloc`, which
+        includes numpy and pandas allocations).
+
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': statistics.median(times),
+            'min_seconds': min(times),
+            'repeat': repeat,
+            'peak_memory_mb': peak / 1e6,
+            }
+
+
+def run_benchmarks(outdir, *, n_variants=10000, n_calls=200, repeat=3, processes=1, seed=0):
+    """Run benchmarks on synthetic data written in `outdir` by :func:`write_synthetic_data`.
+
+    Returns
+    -------
+    dict
+        Keyed by benchmark name, with values from :func:`measure` and for
+        benchmarks timing many calls or variants the number of them as 'n'.
+
+    """
+    results = {}
+    cwd = os.getcwd()
+    os.chdir(outdir)  # process_data writes to processed_data and docs in working directory
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results['process_data'] = measure(
+                lambda: process_data.process_data(processes=processes), repeat=1
+            )
+    finally:
+        os.chdir(cwd)
+
+    calculator_csv = os.path.join(outdir, 'escape_calculator_data.csv')
+    snapshot_dir = os.path.join(outdir, 'escape_calculator_snapshot')
+    bindingcalculator.write_snapshot(calculator_csv, snapshot_dir)
+    results['calculator_from_csv'] = measure(
+        lambda: bindingcalculator.BindingCalculator(calculator_csv), repeat
+    )
+    results['calculator_from_snapshot'] = measure(
+        lambda: bindingcalculator.BindingCalculator(snapshot_dir), repeat
+    )
+
+    calc = bindingcalculator.BindingCalculator(calculator_csv, cache_size=0)
+    rng = np.random.default_rng(seed)
+    sites = sorted(calc.sites)
+    variants = [rng.choice(sites, rng.integers(0, 6), replace=False).tolist()
+                for _ in range(n_variants)]
+
+    def many_calls(method):
+        def calls():
+            for mutated_sites in variants[: n_calls]:
+                method(mutated_sites)
+        return calls
+
+    for name, method in [('binding_retained', calc.binding_retained),
+                         ('escape_per_site', calc.escape_per_site)]:
+        results[name] = {**measure(many_calls(method), repeat), 'n': n_calls}
+    results['binding_retained_many'] = {
+        **measure(lambda: calc.binding_retained_many(variants), repeat), 'n': n_variants
+    }
+    return results
+
+
+def compare(results, baseline):
+    """Data frame comparing benchmark `results` to `baseline` results, both as written to JSON."""
+    rows = []
+    for name in sorted(set(results['results']) | set(baseline['results'])):
+        new = results['results'].get(name, {})
+        old = baseline['results'].get(name, {})
+        row = {'benchmark': name}
+        for key in ['seconds', 'peak_memory_mb']:
+            row[f"baseline_{key}"] = old.get(key, np.nan)
+            row[key] = new.get(key, np.nan)
+            row[f"{key}_ratio"] = row[key] / row[f"baseline_{key}"]
+        rows.append(row)
+    if results['parameters'] != baseline['parameters']:
+        print(f"Warning: parameters differ from baseline:\n{results['parameters']}\n"
+              f"{baseline['parameters']}", file=sys.stderr)
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--outdir',
+                        help='directory for synthetic data, by default a temporary directory')
+    parser.add_argument('--n-studies', type=int, default=5)
+    parser.add_argument('--n-conditions', type=int, default=20,
+                        help='number of conditions per study')
+    parser.add_argument('--n-sites', type=int, default=201)
+    parser.add_argument('--n-mutations', type=int, default=19,
+                        help='number of mutations per site')
+    parser.add_argument('--n-variants', type=int, default=10000,
+                        help='number of variants in batched scoring')
+    parser.add_argument('--n-calls', type=int, default=200,
+                        help='number of single calls timed')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of times each benchmark is timed')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='processes used by process_data')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='benchmark_results.json',
+                        help='JSON file to which results are written')
+    parser.add_argument('--compare', help='JSON results of earlier run to compare to')
+    args = parser.parse_args()
+
+    parameters = {key: getattr(args, key) for key in
+                  ['n_studies', 'n_conditions', 'n_sites', 'n_mutations', 'n_variants',
+                   'n_calls', 'repeat', 'processes', 'seed']}
+    with contextlib.ExitStack() as stack:
+        outdir = args.outdir or stack.enter_context(tempfile.TemporaryDirectory())
+        print(f"Writing synthetic data to {outdir}")
+        write_synthetic_data(outdir,
+                             n_studies=args.n_studies,
+                             n_conditions=args.n_conditions,
+                             n_sites=args.n_sites,
+                             n_mutations=args.n_mutations,
+                             seed=args.seed,
+                             )
+        print('Running benchmarks')
+        results = {
+            'parameters': parameters,
+            'environment': {'python': platform.python_version(),
+                            'numpy': np.__version__,
+                            'pandas': pd.__version__,
+                            'platform': platform.platform(),
+                            },
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': run_benchmarks(os.path.abspath(outdir),
+                                      n_variants=args.n_variants,
+                                      n_calls=args.n_calls,
+                                      repeat=args.repeat,
+                                      processes=args.processes,
+                                      seed=args.seed,
+                                      ),
+        }
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote results to {args.output}")
+    print(pd.DataFrame(results['results']).T.to_string())
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nComparison to {args.compare}:")
+        print(compare(results, baseline).to_string(index=False, float_format='%.3g'))
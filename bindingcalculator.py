@@ -3,7 +3,21 @@
 This module can be downloaded from
 `https://github.com/jbloomlab/SARS2_RBD_Ab_escape_maps/blob/main/bindingcalculator.py <https://github.com/jbloomlab/SARS2_RBD_Ab_escape_maps/blob/main/bindingcalculator.py>`_
 
-The module defines :class:`BindingCalculator` which does the calculation.
+The module defines :class:`BindingCalculator` which does the calculation,
+:class:`EscapeData` which holds escape data shared by calculators for several
+configurations, :class:`MutationBindingCalculator` which does the calculation
+for specific amino-acid mutations rather than sites, and :func:`write_snapshot`
+which converts the escape data CSV into a binary snapshot that
+:class:`BindingCalculator` loads faster. Escape data read from a URL are kept
+as snapshots in a local :class:`DataCache`, so are only downloaded and parsed
+again when they change.
+
+:class:`Instrumentation` records the time and memory of stages of building
+and using calculators, :class:`ScoringServer` serves a calculator over HTTP, and
+:func:`sequence_mutated_sites` gives the mutated sites of an RBD sequence.
+Run as a script to score a table of variants or a FASTA of RBD sequences,
+see ``python bindingcalculator.py --help``; with no arguments the doctests
+are run.
 
 Written by Jesse Bloom.
 
@@ -12,9 +26,176 @@ Written by Jesse Bloom.
 __docformat__ = 'numpy'
 
 
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import errno
+import functools
+import hashlib
+import heapq
+import http
+import itertools
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+import warnings
+
+import numpy as np
+
 import pandas as pd
 
 
+_ESCAPE_CALCULATOR_DATA_URL = 'https://raw.githubusercontent.com/jbloomlab/SARS2_RBD_Ab_escape_maps/main/processed_data/escape_calculator_data.csv'
+
+# Wuhan-Hu-1 RBD sequence for sites 319 to 541, as in chain E of PDB 6M0J used by dms-view
+_RBD_REFERENCE_FIRST_SITE = 319
+_RBD_REFERENCE = (
+    'RVQPTESIVRFPNITNLCPFGEVFNATRFASVYAWNRKRISNCVADYSVLYNSASFSTFKCYGVSPTKLNDLCF'
+    'TNVYADSFVIRGDEVRQIAPGQTGKIADYNYKLPDDFTGCVIAWNSNNLDSKVGGNYNYLYRLFRKSNLKPFERD'
+    'ISTEIYQAGSTPCNGVEGFNCYFPLQSYGFQPTNGVGYQPYRVVVLSFELLHAPATVCGPKKSTNLVKNKCVNF'
+)
+
+
+class Instrumentation:
+    """Records wall time, row counts, and peak memory of named stages.
+
+    Pass to :class:`BindingCalculator`, :class:`EscapeData`, or
+    ``process_data.process_data`` to record their stages. Stages with the
+    same name, such as repeated calls of a calculator method, are totaled.
+
+    Parameters
+    ----------
+    callback : callable or None
+        Called with the record of each stage when it finishes, which is a dict
+        keyed by 'stage', 'seconds', 'rows' (`None` if not applicable), and
+        'peak_memory_mb' (`None` if not tracing memory).
+    trace_memory : bool
+        Record the peak memory allocated during each stage, which is traced with
+        :mod:`tracemalloc` and so slows stages down. Before Python 3.9, which
+        added :func:`tracemalloc.reset_peak`, only stages that start tracing
+        record it, so stages nested in other traced stages record `None`.
+
+    Example
+    -------
+    >>> records = []
+    >>> instrumentation = Instrumentation(records.append)
+    >>> for _ in range(2):
+    ...     with instrumentation.stage('example') as record:
+    ...         record['rows'] = 3
+    ...         _ = [0] * 100000
+    >>> records[0]['stage'], records[0]['rows']
+    ('example', 3)
+    >>> records[0]['peak_memory_mb'] > 0.5
+    True
+    >>> report = instrumentation.report()
+    >>> report['example']['calls'], report['example']['rows']
+    (2, 6)
+
+    """
+    def __init__(self, callback=None, *, trace_memory=True):
+        """See main class docstring."""
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self._totals = {}
+        self._peaks = []  # peak traced memory so far in each enclosing stage
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager recording a stage.
+
+        Yields the record of the stage, in which 'rows' can be set.
+
+        """
+        record = {'stage': name, 'rows': None}
+        if self.trace_memory:
+            started = not tracemalloc.is_tracing()
+            measured = started or hasattr(tracemalloc, 'reset_peak')
+            if started:
+                tracemalloc.start()
+            elif measured:
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+                tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            self._peaks.append(base)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            record['peak_memory_mb'] = None
+            if self.trace_memory:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+                if started:
+                    tracemalloc.stop()
+                if measured:
+                    record['peak_memory_mb'] = (peak - base) / 1e6
+            self.add(record)
+
+    def add(self, record):
+        """Add the record of a stage, for instance one recorded in another process."""
+        totals = self._totals.setdefault(
+            record['stage'], {'calls': 0, 'seconds': 0.0, 'rows': None, 'peak_memory_mb': None}
+        )
+        totals['calls'] += 1
+        totals['seconds'] += record['seconds']
+        if record['rows'] is not None:
+            totals['rows'] = (totals['rows'] or 0) + record['rows']
+        if record['peak_memory_mb'] is not None:
+            totals['peak_memory_mb'] = max(totals['peak_memory_mb'] or 0,
+                                           record['peak_memory_mb'])
+        if self.callback is not None:
+            self.callback(record)
+
+    def report(self):
+        """Totals for each stage in the order first recorded.
+
+        Returns
+        -------
+        dict
+            Keyed by stage name, with values keyed by 'calls', 'seconds' (total),
+            'rows' (total), and 'peak_memory_mb' (maximum).
+
+        """
+        return {name: dict(totals) for name, totals in self._totals.items()}
+
+    def to_json(self, path):
+        """Write :meth:`Instrumentation.report` to JSON file `path`."""
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def instrumented_stage(instrumentation, name):
+    """Context manager for stage `name` of `instrumentation`, which may be `None`."""
+    if instrumentation is None:
+        return contextlib.nullcontext({})
+    return instrumentation.stage(name)
+
+
+def _instrumented(method):
+    """Record calls of calculator `method` as a stage with the number of results as rows."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._instrumentation is None:
+            return method(self, *args, **kwargs)
+        with self._instrumentation.stage(method.__name__) as record:
+            result = method(self, *args, **kwargs)
+            record['rows'] = len(result) if hasattr(result, '__len__') else 1
+        return result
+    return wrapper
+
+
 class BindingCalculator:
     """Calculates residual polyclonal antibody binding after some mutations.
 
@@ -23,9 +204,12 @@ class BindingCalculator:
 
     Parameters
     ----------
-    csv_or_url : str
+    csv_or_url : str or :class:`EscapeData`
         Path to CSV or URL of CSV containing the escape data. Should
-        have columns 'condition', 'metric', and 'escape'.
+        have columns 'condition', 'metric', and 'escape'. Can also be the
+        path to a snapshot directory created by :func:`write_snapshot`,
+        which is memory mapped rather than parsed, or already read
+        :class:`EscapeData` to share with other calculators.
     eliciting_virus : str
         Include antibodies elicited by these viruses.
     known_to_neutralize : str
@@ -35,6 +219,15 @@ class BindingCalculator:
     mutation_escape_strength : float
         Scaling exponent :math:`s`; larger values mean stronger escape, see
         https://jbloomlab.github.io/SARS2_RBD_Ab_escape_maps/escape-calc/
+    cache_size : int
+        Maximum number of sets of mutated sites for which the per-condition
+        binding retained is cached, evicting the least recently used. Each
+        entry holds one float per condition. Set to 0 to disable caching.
+    instrumentation : :class:`Instrumentation` or None
+        Record stages of reading the data (unless already read
+        :class:`EscapeData` is passed) and calls of the scoring methods.
+    cache : :class:`DataCache`, None, or False
+        Cache for escape data read from a URL, see :class:`EscapeData`.
 
     Attributes
     ----------
@@ -108,13 +301,66 @@ class BindingCalculator:
     2     B.1.1.7             [501]             0.979
     3     B.1.429             [452]             0.863
 
+    But it is much faster to score all the variants in a single batch:
+
+    >>> bindcalc.binding_retained_many(variants['mutated RBD sites']).round(3)
+    0    1.000
+    1    0.728
+    2    0.979
+    3    0.863
+    dtype: float64
+
+    For a phylogeny given as the parent of each node and each node's mutated
+    sites, the binding retained is updated incrementally from parent to child:
+
+    >>> bindcalc.binding_retained_tree([-1, 0, 1, 2], [[], [484], [417, 484], [484]]).round(3)
+    array([1.   , 0.798, 0.737, 0.798])
+
+    Bootstrap confidence intervals resample the antibodies (conditions):
+
+    >>> boot = bindcalc.binding_retained_bootstrap([[484], [417, 484]], seed=1)
+    >>> boot.columns.tolist()
+    ['binding_retained', 'mean', 'lower', 'upper']
+    >>> bool((boot['lower'] <= boot['upper']).all())
+    True
+
+    For sensitivity analyses, we can score variants under several mutation
+    escape strengths at once:
+
+    >>> sweep = bindcalc.binding_retained_sweep([[484], [417, 484]], [1, 2, 3])
+    >>> sweep[2].round(3).tolist()
+    [0.798, 0.737]
+
+    Results for each set of mutated sites are cached, and the binding retained
+    after adding one more site to a set is derived from the cached set:
+
+    >>> round(bindcalc.binding_retained_plus([417], 484), 3)
+    0.737
+
+    We can also get the binding retained after adding each possible single
+    site to a background in one call:
+
+    >>> landscape = bindcalc.single_site_landscape([417, 484])
+    >>> round(landscape.set_index('site').at[501, 'binding_retained'], 3)
+    0.728
+
+    To forecast escape routes, we can search for the additional sites that most
+    reduce binding retained from a starting set of mutated sites using greedy,
+    beam, or exact branch-and-bound search:
+
+    >>> paths = bindcalc.escape_paths([417, 484, 501], 2, method='beam', n_paths=3)
+    >>> paths.columns.tolist()
+    ['added_sites', 'binding_retained']
+    >>> len(paths)
+    3
+
     We can also calculate the escape remaining at each site after a mutation:
 
     >>> bindcalc.escape_per_site([417, 484]).query('site in [484, 486, 490]')
-         site original_escape retained_escape
-    134   484        0.919699        0.118626
-    136   486        0.885299        0.687707
-    139   490        0.756283        0.233858
+         site  original_escape  retained_escape
+    134   484         0.919699         0.118626
+    136   486         0.885299         0.687707
+    139   490         0.756283         0.233858
 
     Now do the same but **not** weighting by log IC50:
 
@@ -140,71 +386,40 @@ class BindingCalculator:
 
     """
     def __init__(self,
-        csv_or_url='https://raw.githubusercontent.com/jbloomlab/SARS2_RBD_Ab_escape_maps/main/processed_data/escape_calculator_data.csv',
+        csv_or_url=_ESCAPE_CALCULATOR_DATA_URL,
         *,
         eliciting_virus='SARS-CoV-2',
         known_to_neutralize="any",
         weight_by_log_IC50=True,
         mutation_escape_strength=2,
+        cache_size=1024,
+        instrumentation=None,
+        cache=None,
     ):
         """See main class docstring."""
-        # read escape data 
-        self.escape_data = (
-            pd.read_csv(csv_or_url)
-            .assign(
-                eliciting_virus=lambda x: x["eliciting_virus"].str.split(";"),
-                known_to_neutralize=lambda x: x["known_to_neutralize"].str.split(";"),
-                neg_log_IC50=lambda x: x["neg_log_IC50"].map(
-                    lambda s: tuple([pd.NA if si == "NA" else float(si) for si in s.split(";")])
-                )
-            )
-            .explode("eliciting_virus")
-            .explode(["known_to_neutralize", "neg_log_IC50"])
-        )
-        assert all(self.escape_data["neg_log_IC50"] >= 0)
-
-        # make sure escape data has expected columns
-        if not set(self.escape_data.columns).issuperset({'condition',
-                                                         'site',
-                                                         'escape',
-                                                         'eliciting_virus',
-                                                         "known_to_neutralize",
-                                                         "neg_log_IC50",
-                                                         }):
-            raise ValueError(f"{self.escape_data.columns=} lacks expected columns")
-
-        # filter by virus
-        eliciting_viruses = set(self.escape_data["eliciting_virus"])
-        if eliciting_virus not in eliciting_viruses:
-            raise ValueError(f"{eliciting_virus=} not in {eliciting_viruses=}")
-        self.escape_data = self.escape_data.query('eliciting_virus == @eliciting_virus').drop(
-            columns="eliciting_virus"
-        )
-        assert len(self.escape_data) == len(self.escape_data.drop_duplicates())
+        self._instrumentation = instrumentation
 
-        # filter by known_to_neutralize
-        if known_to_neutralize not in set(self.escape_data['known_to_neutralize']):
-            raise ValueError(f"invalid {known_to_neutralize=}")
-        self.escape_data = (
-            self.escape_data
-            .query("known_to_neutralize == @known_to_neutralize")
-            .drop(columns="known_to_neutralize")
-        )
-        assert len(self.escape_data) == len(self.escape_data.drop_duplicates())
+        # read escape data, or use already read data shared with other calculators
+        if isinstance(csv_or_url, EscapeData):
+            self._data = csv_or_url
+        else:
+            self._data = EscapeData(csv_or_url, instrumentation=instrumentation, cache=cache)
+        data = self._data
+        self._eliciting_virus = eliciting_virus
+        self._known_to_neutralize = known_to_neutralize
 
-        # get escape scaled by the max escape for that condition
-        self.escape_data = (
-                self.escape_data
-                .assign(max_escape=lambda x: (x.groupby('condition')
-                                              ['escape']
-                                              .transform('max')
-                                              ),
-                        scale_escape=lambda x: x['escape'] / x['max_escape'],
-                        )
-                )
+        with instrumented_stage(instrumentation, 'filter') as stage:
+            # filter by virus
+            if eliciting_virus not in data.eliciting_viruses:
+                raise ValueError(f"{eliciting_virus=} not in eliciting_viruses={data.eliciting_viruses}")
+            conditions = data._condition_configs.query("eliciting_virus == @eliciting_virus")
 
-        # get all sites for which we have escape data
-        self.sites = set(self.escape_data['site'])
+            # filter by known_to_neutralize
+            if known_to_neutralize not in set(conditions['known_to_neutralize']):
+                raise ValueError(f"invalid {known_to_neutralize=}")
+            conditions = conditions.query("known_to_neutralize == @known_to_neutralize")
+            assert conditions["condition"].is_unique
+            stage['rows'] = len(conditions)
 
         # set mutation escape strength
         self.mutation_escape_strength = mutation_escape_strength
@@ -212,23 +427,122 @@ class BindingCalculator:
         # do we weight by log IC50?
         self.weight_by_log_IC50 = weight_by_log_IC50
 
-        assert (
-            self.escape_data["condition"].nunique()
-            == len(self.escape_data[["condition", "neg_log_IC50"]].drop_duplicates())
-        )
-
-        # number of conditions (antibodies), weighting by negative log IC50 if doing that
+        # The condition x site matrices are shared with all calculators using the
+        # same data. Conditions not included in this calculator have zero weight.
+        self._conditions = data._conditions
+        self._sites = data._sites
+        self._site_index = data._site_index
+        self._scale_escape = data._scale_escape
+        self._escape = data._escape
+        irows = data._condition_index.get_indexer(conditions["condition"])
+        self._irows = irows
+        self._weights = np.zeros(len(self._conditions))
         if self.weight_by_log_IC50:
-            self._n_conditions = (
-                self.escape_data
-                [["condition", "neg_log_IC50"]]
-                .drop_duplicates()
-                ["neg_log_IC50"]
-                .sum()
-            )
+            self._weights[irows] = conditions["neg_log_IC50"].to_numpy(dtype=float)
         else:
-            self._n_conditions = self.escape_data['condition'].nunique()
+            self._weights[irows] = 1
+
+        # number of conditions (antibodies), weighting by negative log IC50 if doing that
+        self._n_conditions = self._weights.sum()
+
+        # get all sites for which we have escape data
+        self._site_mask = data._has_escape[irows].any(axis=0)
+        self.sites = set(self._sites[self._site_mask].tolist())
+
+        # least-recently-used cache of per-condition products over mutated sites
+        if cache_size < 0:
+            raise ValueError(f"{cache_size=} must be >= 0")
+        self._cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._cache_hits = self._cache_misses = 0
+
+    @functools.cached_property
+    def escape_data(self):
+        """pandas.DataFrame: Escape data for this calculator, see class docstring."""
+        return (
+            self._data.data
+            .query('eliciting_virus == @self._eliciting_virus')
+            .drop(columns="eliciting_virus")
+            .query("known_to_neutralize == @self._known_to_neutralize")
+            .drop(columns="known_to_neutralize")
+            .assign(max_escape=lambda x: (x.groupby('condition')
+                                          ['escape']
+                                          .transform('max')
+                                          ),
+                    scale_escape=lambda x: x['escape'] / x['max_escape'],
+                    )
+        )
+
+    def cache_info(self):
+        """Statistics on the cache of evaluated sets of mutated sites.
+
+        Returns
+        -------
+        dict
+            Keyed by 'hits', 'misses', 'maxsize', and 'currsize'.
+
+        """
+        return {'hits': self._cache_hits,
+                'misses': self._cache_misses,
+                'maxsize': self._cache_size,
+                'currsize': len(self._cache),
+                }
+
+    def cache_clear(self):
+        """Clear the cache of evaluated sets of mutated sites and its statistics."""
+        self._cache.clear()
+        self._cache_hits = self._cache_misses = 0
 
+    def _cache_get(self, key):
+        """Get cached per-condition product for `key`, or `None` if not cached."""
+        if key in self._cache:
+            self._cache_hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self._cache_misses += 1
+        return None
+
+    def _cache_put(self, key, cond_product):
+        """Cache per-condition product for `key`, evicting least recently used."""
+        if self._cache_size:
+            cond_product.flags.writeable = False
+            self._cache[key] = cond_product
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def _site_indices(self, mutated_sites):
+        """Sorted column indices of `mutated_sites` in the escape matrices."""
+        mutated_sites = set(mutated_sites)
+        if not mutated_sites.issubset(self.sites):
+            raise ValueError(f"invalid sites: {mutated_sites - self.sites}")
+        return sorted(self._site_index[site] for site in mutated_sites)
+
+    def _cond_product(self, mutated_sites):
+        """Product over mutated sites of one minus scaled escape for each condition."""
+        icols = self._site_indices(mutated_sites)
+        key = frozenset(icols)
+        cond_product = self._cache_get(key)
+        if cond_product is None:
+            cond_product = (1 - self._scale_escape[:, icols]).prod(axis=1)
+            self._cache_put(key, cond_product)
+        return cond_product
+
+    def _cond_bind_retain(self, mutated_sites):
+        """Binding retained by each condition after mutating indicated sites."""
+        return self._cond_product(mutated_sites) ** self.mutation_escape_strength
+
+    def _cond_bind_retain_matrix(self, indptr, icols):
+        """Binding retained by each condition for variants with mutated sites `indptr`, `icols`.
+
+        See :meth:`EscapeData._mutated_indices` for the format of `indptr` and
+        `icols`. Returns a variant x condition array.
+
+        """
+        return _exp_scaled(self._data._cond_log_product(indptr, icols),
+                           self.mutation_escape_strength)
+
+    @_instrumented
     def escape_per_site(self, mutated_sites):
         """Escape at each site after mutating indicated sites.
 
@@ -244,35 +558,17 @@ class BindingCalculator:
             retained after mutations.
 
         """
-        mutated_sites = set(mutated_sites)
-        if not mutated_sites.issubset(self.sites):
-            raise ValueError(f"invalid sites: {mutated_sites - self.sites}")
-        df = (
-            self.escape_data
-            .assign(
-                mutated=lambda x: x['site'].isin(mutated_sites).astype(int),
-                site_bind_retain=lambda x: 1 - x['scale_escape'] * x['mutated']
-                )
-            .groupby(['condition', "neg_log_IC50"], as_index=False)
-            .aggregate(cond_bind_retain=pd.NamedAgg('site_bind_retain', "prod"))
-            .assign(
-                cond_bind_retain=lambda x: x["cond_bind_retain"].pow(self.mutation_escape_strength),
-                weight=lambda x: x["neg_log_IC50"] if self.weight_by_log_IC50 else 1,
-            )
-            [["condition", 'cond_bind_retain', "weight"]]
-            .merge(self.escape_data[['condition', 'site', 'escape']])
-            .assign(
-                escape=lambda x: x["escape"] * x["weight"],
-                retained_escape=lambda x: x['cond_bind_retain'] * x['escape'],
-            )
-            .groupby('site')
-            .aggregate(
-                original_escape=pd.NamedAgg('escape', 'sum'),
-                retained_escape=pd.NamedAgg('retained_escape', 'sum'),
-            )
-        ) / self._n_conditions
-        return df.reset_index()
+        cond_bind_retain = self._cond_bind_retain(mutated_sites)
+        escape = self._escape[:, self._site_mask]
+        return pd.DataFrame({
+            'site': self._sites[self._site_mask],
+            'original_escape': self._weights @ escape / self._n_conditions,
+            'retained_escape': (
+                (self._weights * cond_bind_retain) @ escape / self._n_conditions
+            ),
+        })
 
+    @_instrumented
     def binding_retained(self, mutated_sites):
         """Fraction binding retained after mutating indicated sites.
 
@@ -287,28 +583,1903 @@ class BindingCalculator:
             The fraction binding retained after these mutations.
 
         """
-        mutated_sites = set(mutated_sites)
-        if not mutated_sites.issubset(self.sites):
-            raise ValueError(f"invalid sites: {mutated_sites - self.sites}")
-        binding_retained = (
-            self.escape_data
-            .assign(
-                mutated=lambda x: x['site'].isin(mutated_sites).astype(int),
-                site_bind_retain=lambda x: 1 - x['scale_escape'] * x['mutated'],
+        cond_bind_retain = self._cond_bind_retain(mutated_sites)
+        return float(self._weights @ cond_bind_retain / self._n_conditions)
+
+    @_instrumented
+    def binding_retained_plus(self, mutated_sites, added_site):
+        """Fraction binding retained after mutating indicated sites plus one more.
+
+        The result is derived from the cached per-condition binding retained
+        for `mutated_sites` (computed and cached if needed), so it is cheap
+        to evaluate many single-site extensions of the same set.
+
+        Parameters
+        ----------
+        mutated_sites : array-like of integers
+            List of mutated sites, must all be in :attr:`BindingCalculator.sites`.
+        added_site : int
+            Additional mutated site, must be in :attr:`BindingCalculator.sites`.
+
+        Returns
+        -------
+        float
+            The fraction binding retained after mutating `mutated_sites`
+            and `added_site`.
+
+        """
+        icols = self._site_indices(mutated_sites)
+        (iadd,) = self._site_indices([added_site])
+        key = frozenset(icols).union([iadd])
+        cond_product = self._cache_get(key)
+        if cond_product is None:
+            cond_product = self._cond_product(mutated_sites)
+            if iadd not in icols:
+                cond_product = cond_product * (1 - self._scale_escape[:, iadd])
+            self._cache_put(key, cond_product)
+        cond_bind_retain = cond_product ** self.mutation_escape_strength
+        return float(self._weights @ cond_bind_retain / self._n_conditions)
+
+    @_instrumented
+    def single_site_landscape(self, background_sites, *, retained_escape=False):
+        """Binding retained after adding each single site to a background.
+
+        Parameters
+        ----------
+        background_sites : array-like of integers
+            Mutated sites in the background, must all be in
+            :attr:`BindingCalculator.sites`.
+        retained_escape : bool
+            Also return the escape retained at each site after adding each site.
+
+        Returns
+        -------
+        pandas.DataFrame or tuple
+            Data frame with a row for each site in :attr:`BindingCalculator.sites`
+            not in `background_sites` and columns 'site', 'binding_retained', and
+            'delta_binding_retained' (change relative to background). If
+            `retained_escape` is `True`, a tuple of this data frame and another with
+            index 'added_site' and a column for each site giving the retained escape
+            as in the 'retained_escape' column of :meth:`BindingCalculator.escape_per_site`.
+
+        """
+        icols = self._site_indices(background_sites)
+        background_product = self._cond_product(background_sites)
+        candidates = np.setdiff1d(np.flatnonzero(self._site_mask), icols)
+        cond_bind_retain = (
+            background_product[:, None] * (1 - self._scale_escape[:, candidates])
+        ) ** self.mutation_escape_strength
+        binding_retained = self._weights @ cond_bind_retain / self._n_conditions
+        background_binding_retained = self._binding_retained_from_products(background_product)
+        landscape = pd.DataFrame({
+            'site': self._sites[candidates],
+            'binding_retained': binding_retained,
+            'delta_binding_retained': binding_retained - background_binding_retained,
+        })
+        if not retained_escape:
+            return landscape
+        site_retained_escape = pd.DataFrame(
+            (cond_bind_retain.T * self._weights) @ self._escape[:, self._site_mask]
+            / self._n_conditions,
+            index=pd.Index(self._sites[candidates], name='added_site'),
+            columns=pd.Index(self._sites[self._site_mask], name='site'),
+        )
+        return landscape, site_retained_escape
+
+    @_instrumented
+    def escape_paths(self,
+                     mutated_sites,
+                     n_added,
+                     *,
+                     method='beam',
+                     beam_width=10,
+                     n_paths=10,
+                     ):
+        """Find additional mutated sites that most reduce binding retained.
+
+        Parameters
+        ----------
+        mutated_sites : array-like of integers
+            Starting mutated sites, must all be in :attr:`BindingCalculator.sites`.
+        n_added : int
+            Number of additional sites to mutate.
+        method : {'greedy', 'beam', 'exact'}
+            Search method. 'greedy' adds the best site at each step, 'beam' keeps
+            the `beam_width` best sets at each step, and 'exact' does a
+            branch-and-bound search over all sets of `n_added` sites.
+        beam_width : int
+            Number of sets kept at each step for 'beam' search.
+        n_paths : int
+            Number of best sets of additional sites to return.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns 'added_sites' (tuple of sites in order added, or sorted for
+            'exact' search) and 'binding_retained', sorted from lowest to highest
+            binding retained. For 'greedy' and 'beam' search, the best sets are
+            chosen from the final step of the search.
+
+        """
+        if method not in {'greedy', 'beam', 'exact'}:
+            raise ValueError(f"invalid {method=}")
+        icols = self._site_indices(mutated_sites)
+        candidates = np.setdiff1d(np.flatnonzero(self._site_mask), icols)
+        if not (1 <= n_added <= len(candidates)):
+            raise ValueError(f"{n_added=} must be between 1 and {len(candidates)}")
+        if n_paths < 1 or beam_width < 1:
+            raise ValueError(f"{n_paths=} and {beam_width=} must be >= 1")
+        start_product = self._cond_product(mutated_sites)
+        if method == 'exact':
+            paths = self._escape_paths_exact(start_product, candidates, n_added, n_paths)
+        else:
+            paths = self._escape_paths_beam(
+                start_product,
+                candidates,
+                n_added,
+                1 if method == 'greedy' else beam_width,
+                n_paths,
             )
-            .groupby(['condition', 'neg_log_IC50'], as_index=False)
-            .aggregate(cond_bind_retain=pd.NamedAgg('site_bind_retain', "prod"))
-            .assign(
-                cond_bind_retain=lambda x: x["cond_bind_retain"].pow(self.mutation_escape_strength),
-                weight=lambda x: x["neg_log_IC50"] if self.weight_by_log_IC50 else 1,
-                weighted_cond_bind_retain=lambda x: x["cond_bind_retain"] * x["weight"],
+        return pd.DataFrame(
+            [(tuple(self._sites[list(path)].tolist()), score) for score, path in paths],
+            columns=['added_sites', 'binding_retained'],
+        )
+
+    def _binding_retained_from_products(self, cond_products):
+        """Binding retained for condition x set array of per-condition products."""
+        return self._weights @ cond_products ** self.mutation_escape_strength / self._n_conditions
+
+    def _escape_paths_beam(self, start_product, candidates, n_added, beam_width, n_paths):
+        """Beam search for :meth:`BindingCalculator.escape_paths`."""
+        factors = 1 - self._scale_escape
+        beam = [(start_product, ())]
+        for step in range(n_added):
+            n_keep = n_paths if step == n_added - 1 else beam_width
+            children = {}
+            for ibeam, (cond_product, path) in enumerate(beam):
+                icands = np.setdiff1d(candidates, path)
+                scores = self._binding_retained_from_products(
+                    cond_product[:, None] * factors[:, icands]
+                )
+                for i in np.argsort(scores, kind='stable')[: n_keep]:
+                    key = frozenset(path).union([icands[i]])
+                    if key not in children:
+                        children[key] = (scores[i], ibeam, icands[i])
+            best = sorted(children.values(), key=lambda t: t[0])[: n_keep]
+            scores = [score for score, _, _ in best]
+            beam = [(beam[ibeam][0] * factors[:, icand], beam[ibeam][1] + (icand,))
+                    for _, ibeam, icand in best]
+        return list(zip(scores, (path for _, path in beam)))
+
+    def _escape_paths_exact(self, start_product, candidates, n_added, n_paths):
+        """Branch-and-bound search for :meth:`BindingCalculator.escape_paths`.
+
+        Candidates are ordered by their effect as single added sites, and sets
+        are enumerated as increasing sequences in that order. A set is pruned
+        if even multiplying each condition by its smallest remaining factors
+        could not beat the current `n_paths` best sets. Before any are found,
+        the `n_paths` best sets from a beam search give the pruning threshold.
+
+        """
+        beam_paths = self._escape_paths_beam(
+            start_product, candidates, n_added, 2 * n_paths, n_paths
+        )
+        beam_threshold = beam_paths[-1][0] + 1e-12 if len(beam_paths) == n_paths else np.inf
+        factors = 1 - self._scale_escape
+        candidates = candidates[np.argsort(
+            self._binding_retained_from_products(start_product[:, None] * factors[:, candidates]),
+            kind='stable',
+        )]
+        factors = factors[:, candidates]
+        n_cands = len(candidates)
+
+        # min_products[i, :, r - 1] is the product of the r smallest factors
+        # for each condition among candidates i, i + 1, ...
+        min_products = np.ones((n_cands + 1, len(factors), n_added))
+        smallest = np.ones((len(factors), n_added))
+        for i in range(n_cands - 1, -1, -1):
+            smallest = np.sort(np.hstack([smallest, factors[:, [i]]]), axis=1)[:, : n_added]
+            min_products[i] = smallest.cumprod(axis=1)
+
+        best = []  # max-heap via negated scores of the `n_paths` best sets
+
+        def search(cond_product, path, istart):
+            n_remaining = n_added - len(path) - 1
+            child_products = cond_product[:, None] * factors[:, istart: n_cands - n_remaining]
+            if n_remaining:
+                bound_products = child_products * (
+                    min_products[istart + 1: n_cands - n_remaining + 1, :, n_remaining - 1].T
+                )
+            else:
+                bound_products = child_products
+            bounds = self._binding_retained_from_products(bound_products)
+            for i in np.argsort(bounds, kind='stable'):
+                threshold = -best[0][0] if len(best) == n_paths else beam_threshold
+                if bounds[i] > threshold:
+                    break
+                child_path = path + (istart + i,)
+                if n_remaining:
+                    search(child_products[:, i], child_path, istart + i + 1)
+                elif len(best) < n_paths:
+                    heapq.heappush(best, (-bounds[i], child_path))
+                else:
+                    heapq.heappushpop(best, (-bounds[i], child_path))
+
+        search(start_product, (), 0)
+        return [(-negscore, sorted(candidates[list(path)]))
+                for negscore, path in sorted(best, reverse=True)]
+
+    @_instrumented
+    def binding_retained_many(self, mutated_sites_list, *, chunksize=1000):
+        """Fraction binding retained for each of many sets of mutated sites.
+
+        Parameters
+        ----------
+        mutated_sites_list : array-like or pandas.Series
+            Each entry is a list of mutated sites, which must all be in
+            :attr:`BindingCalculator.sites`.
+        chunksize : int
+            Number of variants scored at a time, bounds memory usage.
+
+        Returns
+        -------
+        numpy.ndarray or pandas.Series
+            The fraction binding retained for each entry. A series with the
+            same index is returned if `mutated_sites_list` is a series.
+
+        """
+        index = mutated_sites_list.index if isinstance(mutated_sites_list, pd.Series) else None
+        mutated_sites_list = list(mutated_sites_list)
+        binding_retained = np.empty(len(mutated_sites_list))
+        for start in range(0, len(mutated_sites_list), chunksize):
+            chunk = mutated_sites_list[start: start + chunksize]
+            indptr, icols = self._data._mutated_indices(chunk, self.sites)
+            binding_retained[start: start + len(chunk)] = (
+                self._cond_bind_retain_matrix(indptr, icols) @ self._weights / self._n_conditions
             )
-            ['weighted_cond_bind_retain']
-            .sum()
-        ) / self._n_conditions
+        if index is not None:
+            return pd.Series(binding_retained, index=index)
+        return binding_retained
+
+    def iter_binding_retained_tree(self, parents, mutated_sites):
+        """Yield binding retained for each node of a tree, computed incrementally.
+
+        The tree is traversed depth first. The per-condition binding retained
+        of each node is derived from that of its parent by multiplying in the
+        sites mutated in the node but not its parent, and dividing out the sites
+        mutated in the parent but not the node (reversions). Conditions fully
+        escaped by a reverted site are recomputed from scratch. Only the
+        per-condition vectors of nodes on the current path are kept in memory.
+
+        Parameters
+        ----------
+        parents : array-like of integers
+            Index of parent of each node, or -1 (or `None`) for roots.
+        mutated_sites : array-like
+            For each node, the list of its mutated sites, which must all be in
+            :attr:`BindingCalculator.sites`.
+
+        Yields
+        ------
+        tuple
+            `(node, binding_retained)` for each node in depth-first order.
+
+        """
+        parents = [-1 if parent is None else parent for parent in parents]
+        if len(parents) != len(mutated_sites):
+            raise ValueError(f"{len(parents)=} differs from {len(mutated_sites)=}")
+        roots = []
+        children = [[] for _ in parents]
+        for node, parent in enumerate(parents):
+            if parent < 0:
+                roots.append(node)
+            elif parent < len(parents):
+                children[parent].append(node)
+            else:
+                raise ValueError(f"invalid {parent=} for {node=}")
+
+        factors = 1 - self._scale_escape
+        n_visited = 0
+        stack = [(root, np.ones(len(self._conditions)), frozenset()) for root in reversed(roots)]
+        while stack:
+            node, cond_product, parent_icols = stack.pop()
+            icols = frozenset(self._site_indices(mutated_sites[node]))
+            added = sorted(icols - parent_icols)
+            removed = sorted(parent_icols - icols)
+            if added:
+                cond_product = cond_product * factors[:, added].prod(axis=1)
+            if removed:
+                removed_product = factors[:, removed].prod(axis=1)
+                recompute = removed_product == 0
+                cond_product = cond_product / np.where(recompute, 1, removed_product)
+                if recompute.any():
+                    cond_product[recompute] = factors[np.ix_(recompute, sorted(icols))].prod(axis=1)
+            n_visited += 1
+            yield node, self._binding_retained_from_products(cond_product)
+            for child in reversed(children[node]):
+                stack.append((child, cond_product, icols))
+        if n_visited != len(parents):
+            raise ValueError("some nodes are not descended from a root, `parents` has a cycle")
+
+    @_instrumented
+    def binding_retained_tree(self, parents, mutated_sites):
+        """Fraction binding retained for each node of a tree, computed incrementally.
+
+        See :meth:`BindingCalculator.iter_binding_retained_tree`, which streams
+        the same results.
+
+        Parameters
+        ----------
+        parents : array-like of integers
+            Index of parent of each node, or -1 (or `None`) for roots.
+        mutated_sites : array-like
+            For each node, the list of its mutated sites, which must all be in
+            :attr:`BindingCalculator.sites`.
+
+        Returns
+        -------
+        numpy.ndarray
+            The fraction binding retained for each node.
+
+        """
+        binding_retained = np.empty(len(mutated_sites))
+        for node, node_binding_retained in self.iter_binding_retained_tree(parents, mutated_sites):
+            binding_retained[node] = node_binding_retained
         return binding_retained
 
+    def _bootstrap_weights(self, n_bootstrap, seed):
+        """Bootstrap replicate x included condition array of resampled weights."""
+        if n_bootstrap < 1:
+            raise ValueError(f"{n_bootstrap=} must be >= 1")
+        n = len(self._irows)
+        counts = np.random.default_rng(seed).multinomial(n, np.full(n, 1 / n), size=n_bootstrap)
+        return counts * self._weights[self._irows]
+
+    @staticmethod
+    def _ci_bounds(ci):
+        """Lower and upper quantiles for a central percentile interval."""
+        if not 0 < ci < 1:
+            raise ValueError(f"{ci=} must be between 0 and 1")
+        return (1 - ci) / 2, (1 + ci) / 2
+
+    @_instrumented
+    def binding_retained_bootstrap(self,
+        mutated_sites_list,
+        *,
+        n_bootstrap=1000,
+        ci=0.95,
+        seed=None,
+        chunksize=1000,
+        threads=1,
+    ):
+        """Bootstrap confidence intervals on binding retained by resampling conditions.
+
+        The conditions (antibodies) are resampled with replacement, keeping
+        their weights if :attr:`BindingCalculator.weight_by_log_IC50`. The
+        per-condition binding retained is computed once for each variant, and
+        the binding retained for all bootstrap replicates is then a single
+        matrix product with the replicate x condition resampled weights.
+
+        Parameters
+        ----------
+        mutated_sites_list : array-like or pandas.Series
+            Each entry is a list of mutated sites, which must all be in
+            :attr:`BindingCalculator.sites`.
+        n_bootstrap : int
+            Number of bootstrap replicates.
+        ci : float
+            Width of the central percentile interval.
+        seed : int or None
+            Seed for the resampling, which is the same for all variants so that
+            results are reproducible regardless of `chunksize` and `threads`.
+        chunksize : int
+            Number of variants scored at a time, bounds memory usage to about
+            `chunksize` times `n_bootstrap` floats per thread.
+        threads : int
+            Number of threads scoring chunks of variants in parallel.
+
+        Returns
+        -------
+        pandas.DataFrame
+            For each entry in `mutated_sites_list` (with the same index if it is
+            a series), gives the point estimate 'binding_retained', and the
+            bootstrap 'mean' and 'lower' and 'upper' interval bounds.
+
+        """
+        index = mutated_sites_list.index if isinstance(mutated_sites_list, pd.Series) else None
+        mutated_sites_list = list(mutated_sites_list)
+        q = self._ci_bounds(ci)
+        boot_weights = self._bootstrap_weights(n_bootstrap, seed)
+        boot_n_conditions = boot_weights.sum(axis=1)
+
+        def score_chunk(chunk):
+            cond_bind_retain = self._cond_bind_retain_matrix(
+                *self._data._mutated_indices(chunk, self.sites)
+            )
+            boot = cond_bind_retain[:, self._irows] @ boot_weights.T / boot_n_conditions
+            return np.column_stack([
+                cond_bind_retain @ self._weights / self._n_conditions,
+                boot.mean(axis=1),
+                np.quantile(boot, q, axis=1).T,
+            ])
+
+        chunks = [mutated_sites_list[start: start + chunksize]
+                  for start in range(0, len(mutated_sites_list), chunksize)]
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            results = list(executor.map(score_chunk, chunks))
+        return pd.DataFrame(
+            np.vstack(results) if results else np.empty((0, 4)),
+            index=index,
+            columns=['binding_retained', 'mean', 'lower', 'upper'],
+        )
+
+    @_instrumented
+    def escape_per_site_bootstrap(self, mutated_sites, *, n_bootstrap=1000, ci=0.95, seed=None):
+        """Bootstrap confidence intervals on escape per site by resampling conditions.
+
+        Parameters
+        ----------
+        mutated_sites : array-like of integers
+            List of mutated sites, must all be in :attr:`BindingCalculator.sites`.
+        n_bootstrap : int
+            Number of bootstrap replicates.
+        ci : float
+            Width of the central percentile interval.
+        seed : int or None
+            Seed for the resampling.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Same as :meth:`BindingCalculator.escape_per_site` with the additional
+            columns 'retained_escape_mean', 'retained_escape_lower', and
+            'retained_escape_upper'.
+
+        """
+        q = self._ci_bounds(ci)
+        boot_weights = self._bootstrap_weights(n_bootstrap, seed)
+        escape = self._escape[np.ix_(self._irows, np.flatnonzero(self._site_mask))]
+        cond_bind_retain = self._cond_bind_retain(mutated_sites)[self._irows]
+        boot = (boot_weights * cond_bind_retain) @ escape / boot_weights.sum(axis=1)[:, None]
+        lower, upper = np.quantile(boot, q, axis=0)
+        return self.escape_per_site(mutated_sites).assign(
+            retained_escape_mean=boot.mean(axis=0),
+            retained_escape_lower=lower,
+            retained_escape_upper=upper,
+        )
+
+    @_instrumented
+    def binding_retained_sweep(self, mutated_sites_list, strengths, *, chunksize=1000):
+        """Fraction binding retained for many sets of mutated sites and escape strengths.
+
+        The per-condition binding retained is computed once for each set of
+        mutated sites and then raised to each mutation escape strength, rather
+        than using a separate calculator for each strength.
+
+        Parameters
+        ----------
+        mutated_sites_list : array-like or pandas.Series
+            Each entry is a list of mutated sites, which must all be in
+            :attr:`BindingCalculator.sites`.
+        strengths : array-like of floats
+            Values of the mutation escape strength :math:`s`, used instead
+            of :attr:`BindingCalculator.mutation_escape_strength`.
+        chunksize : int
+            Number of variants scored at a time, bounds memory usage.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Rows are entries in `mutated_sites_list` (with the same index if it is
+            a series) and columns are `strengths`.
+
+        """
+        if isinstance(mutated_sites_list, pd.Series):
+            index = mutated_sites_list.index
+        else:
+            index = None
+        mutated_sites_list = list(mutated_sites_list)
+        strengths = list(strengths)
+        binding_retained = np.empty((len(mutated_sites_list), len(strengths)))
+        for start in range(0, len(mutated_sites_list), chunksize):
+            chunk = mutated_sites_list[start: start + chunksize]
+            log_products = self._data._cond_log_product(
+                *self._data._mutated_indices(chunk, self.sites)
+            )
+            for i, strength in enumerate(strengths):
+                binding_retained[start: start + len(chunk), i] = (
+                    _exp_scaled(log_products, strength) @ self._weights / self._n_conditions
+                )
+        return pd.DataFrame(
+            binding_retained,
+            index=index,
+            columns=pd.Index(strengths, name='mutation_escape_strength'),
+        )
+
+    @_instrumented
+    def binding_retained_matrix(self, mutated, *, sites=None, chunksize=1000):
+        """Fraction binding retained for each row of a variant x site matrix.
+
+        Parameters
+        ----------
+        mutated : pandas.DataFrame, numpy.ndarray, or scipy.sparse matrix
+            Boolean matrix with rows for variants and columns for sites, with
+            true values for mutated sites. If a data frame, the columns are
+            the sites.
+        sites : array-like of integers or None
+            Sites for the columns of `mutated`, must all be in
+            :attr:`BindingCalculator.sites`. If `None`, the columns of a data
+            frame or else all sites in :attr:`BindingCalculator.sites` in sorted order.
+        chunksize : int
+            Number of variants scored at a time, bounds memory usage.
+
+        Returns
+        -------
+        numpy.ndarray or pandas.Series
+            The fraction binding retained for each row. A series with the
+            same index is returned if `mutated` is a data frame.
+
+        Example
+        -------
+        >>> import io
+        >>> import scipy.sparse
+        >>> csv = io.StringIO(
+        ...     "condition,site,escape,eliciting_virus,known_to_neutralize,neg_log_IC50\\n"
+        ...     "A,484,1.0,SARS-CoV-2,Wuhan-Hu-1;any,1;1\\n"
+        ...     "B,484,0.5,SARS-CoV-2,Wuhan-Hu-1;any,3;3\\n"
+        ...     "B,417,1.0,SARS-CoV-2,Wuhan-Hu-1;any,3;3\\n"
+        ... )
+        >>> calc = BindingCalculator(csv, weight_by_log_IC50=False)
+        >>> mutated = np.array([[False, True], [True, True], [False, False]])  # sites 417, 484
+        >>> calc.binding_retained_matrix(mutated)
+        array([0.125, 0.   , 1.   ])
+        >>> calc.binding_retained_matrix(scipy.sparse.coo_matrix(mutated), chunksize=2)
+        array([0.125, 0.   , 1.   ])
+
+        """
+        index = None
+        if isinstance(mutated, pd.DataFrame):
+            index = mutated.index
+            if sites is None:
+                sites = mutated.columns
+            mutated = mutated.to_numpy()
+        if sites is None:
+            sites = self._sites[self._site_mask]
+        sites = list(sites)
+        if len(sites) != mutated.shape[1]:
+            raise ValueError(f"{len(sites)=} does not match {mutated.shape[1]=} columns")
+        if len(set(sites)) != len(sites):
+            raise ValueError("duplicate sites")
+        if not set(sites).issubset(self.sites):
+            raise ValueError(f"invalid sites: {set(sites) - self.sites}")
+        icols = np.array([self._site_index[site] for site in sites], dtype=np.intp)
+        if hasattr(mutated, 'tocsr'):
+            # formats such as COO cannot be sliced by row, copy so input is not modified
+            mutated = mutated.tocsr(copy=True)
+            mutated.sum_duplicates()
+            mutated.eliminate_zeros()
+        binding_retained = np.empty(mutated.shape[0])
+        for start in range(0, mutated.shape[0], chunksize):
+            chunk = mutated[start: start + chunksize]
+            if hasattr(chunk, 'tocsr'):
+                indptr, cols = chunk.indptr, chunk.indices
+            else:
+                rows, cols = np.nonzero(np.asarray(chunk))
+                indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=chunk.shape[0]))])
+            binding_retained[start: start + chunk.shape[0]] = (
+                self._cond_bind_retain_matrix(indptr, icols[cols])
+                @ self._weights / self._n_conditions
+            )
+        if index is not None:
+            return pd.Series(binding_retained, index=index)
+        return binding_retained
+
+
+class EscapeData:
+    """Escape data shared by :class:`BindingCalculator` objects for several configurations.
+
+    The escape data are parsed and compiled into condition x site arrays once.
+    Each calculator created from them only stores the weights of the conditions
+    it includes, so many configurations are cheap to create and hold in memory.
+
+    Parameters
+    ----------
+    csv_or_url : str
+        Path to CSV or URL of CSV containing the escape data, or path to a
+        snapshot directory, as for :class:`BindingCalculator`.
+    instrumentation : :class:`Instrumentation` or None
+        Record stages of reading and compiling the data.
+    cache : :class:`DataCache`, None, or False
+        Cache used if `csv_or_url` is a URL: a default :class:`DataCache` if
+        `None`, or no cache if `False`. If the cache directory cannot be
+        written, the data are read without the cache with a warning.
+
+    Attributes
+    ----------
+    data : pandas.DataFrame
+        The escape data, with a row for each eliciting virus and virus known to
+        be neutralized for each condition and site. Only read when first used
+        if the escape data are from a snapshot.
+    eliciting_viruses : set
+        All eliciting viruses in the escape data.
+
+    Example
+    -------
+    Read the escape data once and create calculators for several configurations:
+
+    >>> escape_data = EscapeData('processed_data/escape_calculator_data.csv')
+    >>> calculators = {
+    ...     'weighted': escape_data.calculator(),
+    ...     'unweighted': escape_data.calculator(weight_by_log_IC50=False),
+    ... }
+    >>> round(calculators['unweighted'].binding_retained([484]), 3)
+    0.841
+
+    Score variants under all configurations at once:
+
+    >>> escape_data.binding_retained_many([[484], [417, 484]], calculators).round(3)
+       weighted  unweighted
+    0     0.798       0.841
+    1     0.737       0.791
+
+    """
+
+    def __init__(self, csv_or_url=_ESCAPE_CALCULATOR_DATA_URL, *, instrumentation=None, cache=None):
+        """See main class docstring."""
+        if (cache is not False and isinstance(csv_or_url, str)
+                and csv_or_url.startswith(('http://', 'https://'))):
+            cache = cache or DataCache()
+            with instrumented_stage(instrumentation, 'cache'):
+                try:
+                    csv_or_url = cache.snapshot(csv_or_url)
+                except OSError as e:
+                    if cache.offline or not _is_unwritable(e):
+                        raise
+                    warnings.warn(f"cannot write cache {cache.cache_dir}, "
+                                  f"reading {csv_or_url} without it: {e}")
+        if isinstance(csv_or_url, (str, os.PathLike)) and os.path.isdir(csv_or_url):
+            self._snapshot_dir = csv_or_url
+            if os.path.isfile(os.path.join(csv_or_url, 'compiled_escape.npy')):
+                # validated and compiled when written, so just memory map the arrays
+                with instrumented_stage(instrumentation, 'read_snapshot') as stage:
+                    compiled = _read_compiled_snapshot(csv_or_url)
+                    stage['rows'] = len(compiled['condition_configs'])
+            else:
+                # snapshot from before compiled arrays were written
+                with instrumented_stage(instrumentation, 'read_snapshot') as stage:
+                    self.data = _read_snapshot(csv_or_url)
+                    stage['rows'] = len(self.data)
+                compiled = _compile_escape_data(self.data, instrumentation)
+        else:
+            self.data = _read_csv(csv_or_url, instrumentation)
+            compiled = _compile_escape_data(self.data, instrumentation)
+
+        # negative log IC50 of conditions for each eliciting and neutralized virus
+        self._condition_configs = compiled['condition_configs']
+        self.eliciting_viruses = set(self._condition_configs['eliciting_virus'])
+
+        # dense condition x site matrices
+        self._conditions = compiled['conditions']
+        self._condition_index = pd.Index(self._conditions)
+        self._sites = compiled['sites']
+        self._site_index = {site: i for i, site in enumerate(self._sites.tolist())}
+        self._escape = compiled['escape']
+        self._has_escape = compiled['has_escape']
+        self._scale_escape = compiled['scale_escape']
+        self._site_log_bind_retain = compiled['site_log_bind_retain']
+
+    @functools.cached_property
+    def data(self):
+        """pandas.DataFrame: Escape data, read from the snapshot on first use."""
+        return _read_snapshot(self._snapshot_dir)
+
+    def calculator(self, **kwargs):
+        """Create :class:`BindingCalculator` that shares these escape data.
+
+        Parameters
+        ----------
+        **kwargs
+            Keyword arguments for :class:`BindingCalculator` other than `csv_or_url`.
+
+        Returns
+        -------
+        :class:`BindingCalculator`
+
+        """
+        return BindingCalculator(self, **kwargs)
+
+    def binding_retained_many(self, mutated_sites_list, calculators, *, chunksize=1000):
+        """Fraction binding retained for many sets of mutated sites under several calculators.
+
+        Parameters
+        ----------
+        mutated_sites_list : array-like or pandas.Series
+            Each entry is a list of mutated sites, which must all be in
+            :attr:`BindingCalculator.sites` for at least one calculator. Sites
+            without data for a calculator have no effect on its binding retained.
+        calculators : dict
+            Maps names to :class:`BindingCalculator` objects created from these
+            escape data, for instance with :meth:`EscapeData.calculator`.
+        chunksize : int
+            Number of variants scored at a time, bounds memory usage.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Rows are entries in `mutated_sites_list` (with the same index if it is
+            a series) and columns are the names of `calculators`.
+
+        """
+        if any(calc._data is not self for calc in calculators.values()):
+            raise ValueError("all `calculators` must be created from these escape data")
+        calcs = list(calculators.values())
+        sites = set().union(*(calc.sites for calc in calcs))
+        weights = np.column_stack([calc._weights / calc._n_conditions for calc in calcs]
+                                  or [np.zeros(len(self._conditions))])
+        strengths = collections.defaultdict(list)
+        for icalc, calc in enumerate(calcs):
+            strengths[calc.mutation_escape_strength].append(icalc)
+
+        if isinstance(mutated_sites_list, pd.Series):
+            index = mutated_sites_list.index
+        else:
+            index = None
+        mutated_sites_list = list(mutated_sites_list)
+        binding_retained = np.empty((len(mutated_sites_list), len(calcs)))
+        for start in range(0, len(mutated_sites_list), chunksize):
+            chunk = mutated_sites_list[start: start + chunksize]
+            log_products = self._cond_log_product(*self._mutated_indices(chunk, sites))
+            for strength, icalcs in strengths.items():
+                binding_retained[start: start + len(chunk), icalcs] = (
+                    _exp_scaled(log_products, strength) @ weights[:, icalcs]
+                )
+        return pd.DataFrame(binding_retained, index=index, columns=list(calculators))
+
+    def _mutated_indices(self, mutated_sites_list, sites):
+        """Mutated sites of each variant as columns of the escape matrices.
+
+        Each entry of `mutated_sites_list` must only have sites in `sites`.
+        Returns `(indptr, icols)` where the columns for variant `i` are
+        ``icols[indptr[i]: indptr[i + 1]]``, as in compressed sparse row format.
+
+        """
+        indptr = np.zeros(len(mutated_sites_list) + 1, dtype=np.intp)
+        icols = []
+        for i, mutated_sites in enumerate(mutated_sites_list):
+            mutated_sites = set(mutated_sites)
+            if not mutated_sites.issubset(sites):
+                raise ValueError(f"invalid sites: {mutated_sites - sites}")
+            icols.extend(self._site_index[site] for site in mutated_sites)
+            indptr[i + 1] = len(icols)
+        return indptr, np.array(icols, dtype=np.intp)
+
+    def _cond_log_product(self, indptr, icols):
+        """Log of product over mutated sites of one minus scaled escape for each condition.
+
+        Only the rows of the mutated sites are summed, see
+        :meth:`EscapeData._mutated_indices` for `indptr` and `icols`. Returns
+        a variant x condition array that is -inf for complete escape.
+
+        """
+        n_sites = np.diff(indptr)
+        # With variants sorted by decreasing number of mutated sites, those with
+        # more than `k` sites are a prefix, so the rows of all their `k`-th sites
+        # are added to a contiguous block at once.
+        order = np.argsort(-n_sites, kind='stable')
+        starts = indptr[:-1][order]
+        n_sites = n_sites[order]
+        log_products = np.zeros((len(order), len(self._conditions)))
+        for k in range(n_sites[0] if len(order) else 0):
+            n_variants = np.count_nonzero(n_sites > k)
+            log_products[: n_variants] += self._site_log_bind_retain[icols[starts[: n_variants] + k]]
+        unsorted = np.empty_like(log_products)
+        unsorted[order] = log_products
+        return unsorted
+
+
+def _exp_scaled(log_products, strength):
+    """Products with logs `log_products` raised to `strength`, which can be zero."""
+    if strength == 0:
+        return np.ones_like(log_products)
+    return np.exp(strength * log_products)
+
+
+class MutationBindingCalculator:
+    """Calculates residual polyclonal antibody binding after specific mutations.
+
+    Unlike :class:`BindingCalculator`, which treats any mutation at a site the
+    same, this calculator uses the escape for each amino-acid mutation. The
+    escape is scaled by the max escape of any mutation for that condition, and
+    is stored sparsely by mutation, with the conditions that have escape for it.
+
+    Only :meth:`MutationBindingCalculator.binding_retained` and
+    :meth:`MutationBindingCalculator.binding_retained_many` are implemented,
+    without the other methods and options of :class:`BindingCalculator`. The
+    data must be read from a CSV: snapshots, :class:`DataCache`, and
+    :class:`EscapeData` only hold site-level data, and there is no default
+    source of mutation-level calculator data.
+
+    Parameters
+    ----------
+    csv_or_url : str
+        Path to CSV or URL of CSV containing mutation-level escape data. Should
+        have the same columns as for :class:`BindingCalculator`, plus 'wildtype'
+        and 'mutation' giving the wildtype and mutant amino acid.
+    eliciting_virus : str
+        Include antibodies elicited by these viruses.
+    known_to_neutralize : str
+        Include antibodies known to neutralize this virus.
+    weight_by_log_IC50 : bool
+        Weight antibodies by log IC50.
+    mutation_escape_strength : float
+        Scaling exponent :math:`s`; larger values mean stronger escape.
+
+    Attributes
+    ----------
+    escape_data : pandas.DataFrame
+        The data frame read from `csv_or_url` after filtering for specified
+        `eliciting_virus` and `known_to_neutralize`.
+    sites : set
+        All sites for which we have escape data. We can only calculate effects
+        of mutations at these sites. Mutations at these sites that are not in
+        :attr:`MutationBindingCalculator.mutations` have no escape.
+    mutations : set
+        All mutations with escape data, as strings like 'E484K'.
+    weight_by_log_IC50 : bool
+        Value of `weight_by_log_IC50` passed as parameter.
+
+    Example
+    -------
+    >>> import io
+    >>> csv = io.StringIO(
+    ...     "condition,site,wildtype,mutation,escape,eliciting_virus,known_to_neutralize,neg_log_IC50\\n"
+    ...     "A,484,E,K,0.8,SARS-CoV-2,Wuhan-Hu-1;any,1;1\\n"
+    ...     "A,484,E,A,0.2,SARS-CoV-2,Wuhan-Hu-1;any,1;1\\n"
+    ...     "A,417,K,N,0.4,SARS-CoV-2,Wuhan-Hu-1;any,1;1\\n"
+    ...     "B,484,E,K,0.5,SARS-CoV-2,Wuhan-Hu-1;any,3;3\\n"
+    ...     "B,501,N,Y,1.0,SARS-CoV-2,Wuhan-Hu-1;any,3;3\\n"
+    ... )
+    >>> mutcalc = MutationBindingCalculator(csv)
+    >>> sorted(mutcalc.mutations)
+    ['E484A', 'E484K', 'K417N', 'N501Y']
+
+    Different mutations at the same site have different effects:
+
+    >>> mutcalc.binding_retained(['E484K'])
+    0.1875
+    >>> mutcalc.binding_retained(['E484A'])
+    0.890625
+    >>> mutcalc.binding_retained(['K417N', 'E484A'])
+    0.78515625
+
+    Mutations at sites with data that do not themselves have data have no effect,
+    and the wildtype identity can be omitted:
+
+    >>> mutcalc.binding_retained(['E484Q', '501Y'])
+    0.25
+
+    Many variants can be scored in a single batch:
+
+    >>> mutcalc.binding_retained_many([[], ['E484K'], ['K417N', 'E484A']])
+    array([1.        , 0.1875    , 0.78515625])
+
+    """
+
+    def __init__(self,
+                 csv_or_url,
+                 *,
+                 eliciting_virus='SARS-CoV-2',
+                 known_to_neutralize="any",
+                 weight_by_log_IC50=True,
+                 mutation_escape_strength=2,
+                 ):
+        """See main class docstring."""
+        escape_data = _read_csv(csv_or_url)
+        if not set(escape_data.columns).issuperset({'condition',
+                                                    'site',
+                                                    'wildtype',
+                                                    'mutation',
+                                                    'escape',
+                                                    'eliciting_virus',
+                                                    "known_to_neutralize",
+                                                    "neg_log_IC50",
+                                                    }):
+            raise ValueError(f"{escape_data.columns=} lacks expected columns")
+
+        # filter by virus and known_to_neutralize
+        eliciting_viruses = set(escape_data["eliciting_virus"])
+        if eliciting_virus not in eliciting_viruses:
+            raise ValueError(f"{eliciting_virus=} not in {eliciting_viruses=}")
+        escape_data = escape_data.query('eliciting_virus == @eliciting_virus').drop(
+            columns="eliciting_virus"
+        )
+        if known_to_neutralize not in set(escape_data['known_to_neutralize']):
+            raise ValueError(f"invalid {known_to_neutralize=}")
+        escape_data = (
+            escape_data
+            .query("known_to_neutralize == @known_to_neutralize")
+            .drop(columns="known_to_neutralize")
+        )
+        assert not escape_data.duplicated(['condition', 'site', 'mutation']).any()
+
+        # get escape scaled by the max escape for that condition
+        self.escape_data = escape_data.assign(
+            max_escape=lambda x: x.groupby('condition')['escape'].transform('max'),
+            scale_escape=lambda x: x['escape'] / x['max_escape'],
+        )
+
+        self.mutation_escape_strength = mutation_escape_strength
+        self.weight_by_log_IC50 = weight_by_log_IC50
+
+        wildtypes = self.escape_data[['site', 'wildtype']].drop_duplicates()
+        if not wildtypes['site'].is_unique:
+            raise ValueError("inconsistent wildtype identities at some sites")
+        self._wildtype = dict(zip(wildtypes['site'].tolist(), wildtypes['wildtype']))
+        self.sites = set(self._wildtype)
+        self.mutations = {f"{self._wildtype[site]}{site}{mut}" for site, mut
+                          in zip(self.escape_data['site'].tolist(), self.escape_data['mutation'])}
+
+        # weights and number of conditions, weighting by negative log IC50 if doing that
+        conditions = (
+            self.escape_data
+            [["condition", "neg_log_IC50"]]
+            .drop_duplicates()
+            .sort_values("condition")
+        )
+        assert conditions['condition'].is_unique
+        self._conditions = conditions["condition"].to_numpy()
+        if self.weight_by_log_IC50:
+            self._weights = conditions["neg_log_IC50"].to_numpy(dtype=float)
+        else:
+            self._weights = np.ones(len(self._conditions))
+        self._n_conditions = self._weights.sum()
+
+        # Store scaled escape sparsely by mutation: the entries for mutation j
+        # are at positions self._indptr[j] to self._indptr[j + 1] in arrays of
+        # condition indices and scaled escape.
+        features = self.escape_data[['site', 'mutation']].drop_duplicates().sort_values(
+            ['site', 'mutation']
+        )
+        self._feature_index = {
+            (site, mut): j for j, (site, mut)
+            in enumerate(zip(features['site'].tolist(), features['mutation']))
+        }
+        ifeature = np.array([
+            self._feature_index[site, mut] for site, mut
+            in zip(self.escape_data['site'].tolist(), self.escape_data['mutation'])
+        ], dtype=np.int64)
+        icond = pd.Index(self._conditions).get_indexer(self.escape_data['condition'])
+        order = np.lexsort((icond, ifeature))
+        self._indptr = np.searchsorted(ifeature[order], np.arange(len(features) + 1))
+        self._cond_idx = icond[order]
+        self._scale_escape = self.escape_data['scale_escape'].to_numpy(dtype=float)[order]
+        self._full_escape = (self._scale_escape >= 1).astype(float)
+        with np.errstate(divide='ignore'):
+            self._log_bind_retain = np.where(
+                self._full_escape > 0, 0, np.log(1 - self._scale_escape)
+            )
+
+    _MUTATION_REGEX = re.compile(r'(?P<wt>[A-Z\*\-]?)(?P<site>\d+)(?P<mut>[A-Z\*\-])')
+
+    def _feature_indices(self, mutations):
+        """Sparse column indices of mutations (like 'E484K') with escape data."""
+        ifeatures = []
+        mutated_sites = set()
+        for mutation in mutations:
+            m = self._MUTATION_REGEX.fullmatch(mutation)
+            if not m:
+                raise ValueError(f"invalid {mutation=}")
+            site = int(m.group('site'))
+            if site not in self.sites:
+                raise ValueError(f"invalid site in {mutation=}")
+            if m.group('wt') and m.group('wt') != self._wildtype[site]:
+                raise ValueError(f"{mutation=} has wrong wildtype, expected {self._wildtype[site]}")
+            if site in mutated_sites:
+                raise ValueError(f"multiple mutations at {site=} in {mutations=}")
+            mutated_sites.add(site)
+            if (site, m.group('mut')) in self._feature_index:
+                ifeatures.append(self._feature_index[site, m.group('mut')])
+        return ifeatures
+
+    def binding_retained(self, mutations):
+        """Fraction binding retained after indicated mutations.
+
+        Parameters
+        ----------
+        mutations : array-like of str
+            Mutations like 'E484K' or '484K', must all be at sites in
+            :attr:`MutationBindingCalculator.sites`, at most one per site.
+
+        Returns
+        -------
+        float
+            The fraction binding retained after these mutations.
+
+        """
+        cond_bind_retain = np.ones(len(self._conditions))
+        for j in self._feature_indices(mutations):
+            entries = slice(self._indptr[j], self._indptr[j + 1])
+            cond_bind_retain[self._cond_idx[entries]] *= 1 - self._scale_escape[entries]
+        cond_bind_retain = cond_bind_retain ** self.mutation_escape_strength
+        return float(self._weights @ cond_bind_retain / self._n_conditions)
+
+    def binding_retained_many(self, mutations_list, *, chunksize=1000):
+        """Fraction binding retained for each of many sets of mutations.
+
+        Parameters
+        ----------
+        mutations_list : array-like or pandas.Series
+            Each entry is a list of mutations as for
+            :meth:`MutationBindingCalculator.binding_retained`.
+        chunksize : int
+            Number of variants scored at a time, bounds memory usage.
+
+        Returns
+        -------
+        numpy.ndarray or pandas.Series
+            The fraction binding retained for each entry. A series with the
+            same index is returned if `mutations_list` is a series.
+
+        """
+        index = mutations_list.index if isinstance(mutations_list, pd.Series) else None
+        mutations_list = list(mutations_list)
+        n_conds = len(self._conditions)
+        binding_retained = np.empty(len(mutations_list))
+        for start in range(0, len(mutations_list), chunksize):
+            chunk = mutations_list[start: start + chunksize]
+            # gather sparse entries for every (variant, mutation) pair in chunk
+            ifeatures = [self._feature_indices(mutations) for mutations in chunk]
+            ivariant = np.repeat(np.arange(len(chunk)), [len(js) for js in ifeatures])
+            ifeatures = np.array([j for js in ifeatures for j in js], dtype=np.int64)
+            n_entries = self._indptr[ifeatures + 1] - self._indptr[ifeatures]
+            entries = (np.repeat(self._indptr[ifeatures] - np.cumsum(n_entries) + n_entries,
+                                 n_entries)
+                       + np.arange(n_entries.sum()))
+            flat = np.repeat(ivariant, n_entries) * n_conds + self._cond_idx[entries]
+            size = len(chunk) * n_conds
+            cond_bind_retain = np.exp(
+                np.bincount(flat, weights=self._log_bind_retain[entries], minlength=size)
+            ).reshape(len(chunk), n_conds)
+            full_escape = np.bincount(flat, weights=self._full_escape[entries], minlength=size)
+            cond_bind_retain[full_escape.reshape(len(chunk), n_conds) > 0] = 0
+            binding_retained[start: start + len(chunk)] = (
+                cond_bind_retain ** self.mutation_escape_strength
+                @ self._weights / self._n_conditions
+            )
+        if index is not None:
+            return pd.Series(binding_retained, index=index)
+        return binding_retained
+
+
+def _read_csv(csv_or_url, instrumentation=None):
+    """Read escape data CSV with one row per eliciting virus and neutralized virus."""
+    with instrumented_stage(instrumentation, 'read_csv') as stage:
+        escape_data = pd.read_csv(csv_or_url)
+        stage['rows'] = len(escape_data)
+    with instrumented_stage(instrumentation, 'explode') as stage:
+        escape_data = (
+            escape_data
+            .assign(
+                eliciting_virus=lambda x: x["eliciting_virus"].str.split(";"),
+                known_to_neutralize=lambda x: x["known_to_neutralize"].str.split(";"),
+                neg_log_IC50=lambda x: x["neg_log_IC50"].map(
+                    lambda s: tuple([pd.NA if si == "NA" else float(si) for si in s.split(";")])
+                )
+            )
+            .explode("eliciting_virus")
+            .explode(["known_to_neutralize", "neg_log_IC50"])
+        )
+        assert all(escape_data["neg_log_IC50"] >= 0)
+        stage['rows'] = len(escape_data)
+    return escape_data
+
+
+def _compile_escape_data(data, instrumentation=None):
+    """Validate escape data read by :func:`_read_csv` and compile condition x site arrays.
+
+    Returns a dict keyed by 'condition_configs' (data frame of the negative
+    log IC50 of each condition for each eliciting and neutralized virus) and
+    by the names in `_SNAPSHOT_COMPILED`.
+
+    """
+    with instrumented_stage(instrumentation, 'validate') as stage:
+        # make sure escape data has expected columns
+        if not set(data.columns).issuperset({'condition',
+                                             'site',
+                                             'escape',
+                                             'eliciting_virus',
+                                             "known_to_neutralize",
+                                             "neg_log_IC50",
+                                             }):
+            raise ValueError(f"{data.columns=} lacks expected columns")
+        assert not data.duplicated(
+            ['condition', 'site', 'eliciting_virus', 'known_to_neutralize']
+        ).any()
+        stage['rows'] = len(data)
+
+    with instrumented_stage(instrumentation, 'compile') as stage:
+        compiled = {'condition_configs': data[
+            ['condition', 'eliciting_virus', 'known_to_neutralize', 'neg_log_IC50']
+        ].drop_duplicates()}
+
+        # compile escape into dense condition x site matrices
+        site_escape = data[['condition', 'site', 'escape']].drop_duplicates()
+        assert not site_escape.duplicated(['condition', 'site']).any()
+        conditions = np.array(sorted(set(site_escape['condition'])), dtype=object)
+        sites = np.array(sorted(set(site_escape['site'])))
+        irow = pd.Index(conditions).get_indexer(site_escape['condition'])
+        icol = pd.Index(sites).get_indexer(site_escape['site'])
+        escape = np.zeros((len(conditions), len(sites)))
+        escape[irow, icol] = site_escape['escape'].to_numpy()
+        has_escape = np.zeros((len(conditions), len(sites)), dtype=bool)
+        has_escape[irow, icol] = True
+        compiled.update(conditions=conditions, sites=sites, escape=escape, has_escape=has_escape)
+        stage['rows'] = len(site_escape)
+
+    with instrumented_stage(instrumentation, 'scale') as stage:
+        # get escape scaled by the max escape for that condition
+        max_escape = site_escape.groupby('condition')['escape'].max()
+        compiled['scale_escape'] = np.where(
+            has_escape, escape / max_escape.reindex(conditions).to_numpy()[:, None], 0,
+        )
+
+        # log of binding retained with a row per site and a column per
+        # condition for summing over mutated sites, -inf for complete escape
+        with np.errstate(divide='ignore'):
+            compiled['site_log_bind_retain'] = np.ascontiguousarray(
+                np.log(np.clip(1 - compiled['scale_escape'], 0, None)).T
+            )
+        stage['rows'] = escape.size
+    return compiled
+
+
+# integer-coded columns in snapshots, each with a '<col>_names' array of values
+_SNAPSHOT_CODED = ['condition', 'eliciting_virus', 'known_to_neutralize']
+
+# numeric columns in snapshots, the row index of the CSV is saved as 'index'
+_SNAPSHOT_NUMERIC = ['index', 'site', 'escape', 'neg_log_IC50']
+
+# arrays from :func:`_compile_escape_data` in snapshots, saved as 'compiled_<name>',
+# with the columns of the condition configurations saved as 'compiled_condition_configs_<col>'
+_SNAPSHOT_COMPILED = ['conditions', 'sites', 'escape', 'has_escape', 'scale_escape',
+                      'site_log_bind_retain']
+_SNAPSHOT_CONDITION_CONFIGS = ['condition', 'eliciting_virus', 'known_to_neutralize',
+                               'neg_log_IC50']
+
+
+def write_snapshot(csv_or_url, snapshot_dir):
+    """Write escape data CSV as a binary snapshot for :class:`BindingCalculator`.
+
+    The snapshot holds the parsed escape data, with one row per eliciting virus
+    and neutralized virus, as a directory of ``.npy`` arrays that are memory
+    mapped on loading. String columns are integer coded. The data are
+    validated and compiled into the condition x site arrays used by the
+    calculators when written, so loading the snapshot only memory maps those.
+
+    Parameters
+    ----------
+    csv_or_url : str
+        Path to CSV or URL of CSV containing the escape data, as for
+        :class:`BindingCalculator`.
+    snapshot_dir : str
+        Directory in which snapshot is written, created if needed.
+
+    """
+    escape_data = _read_csv(csv_or_url)
+    compiled = _compile_escape_data(escape_data)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    for col in _SNAPSHOT_CODED:
+        codes, names = pd.factorize(escape_data[col])
+        np.save(os.path.join(snapshot_dir, f"{col}.npy"), codes.astype(np.int32))
+        np.save(os.path.join(snapshot_dir, f"{col}_names.npy"), names.to_numpy(dtype=str))
+    np.save(os.path.join(snapshot_dir, 'index.npy'), escape_data.index.to_numpy(dtype=np.int64))
+    np.save(os.path.join(snapshot_dir, 'site.npy'), escape_data['site'].to_numpy(dtype=np.int32))
+    for col in ['escape', 'neg_log_IC50']:
+        np.save(os.path.join(snapshot_dir, f"{col}.npy"),
+                escape_data[col].to_numpy(dtype=float, na_value=np.nan))
+    for name in _SNAPSHOT_COMPILED:
+        np.save(os.path.join(snapshot_dir, f"compiled_{name}.npy"),
+                compiled[name].astype(str) if name == 'conditions' else compiled[name])
+    for col in _SNAPSHOT_CONDITION_CONFIGS:
+        values = compiled['condition_configs'][col]
+        np.save(os.path.join(snapshot_dir, f"compiled_condition_configs_{col}.npy"),
+                values.to_numpy(dtype=float, na_value=np.nan) if col == 'neg_log_IC50'
+                else values.to_numpy(dtype=str))
+
+
+def _read_snapshot(snapshot_dir):
+    """Read escape data from snapshot written by :func:`write_snapshot`."""
+    arrays = {}
+    for name in _SNAPSHOT_NUMERIC + _SNAPSHOT_CODED + [f"{c}_names" for c in _SNAPSHOT_CODED]:
+        f = os.path.join(snapshot_dir, f"{name}.npy")
+        if not os.path.isfile(f):
+            raise ValueError(f"{snapshot_dir=} is not a valid snapshot, lacks {f}")
+        arrays[name] = np.load(f, mmap_mode='r')
+    return pd.DataFrame(
+        {
+            'condition': arrays['condition_names'][arrays['condition']].astype(object),
+            'site': arrays['site'],
+            'escape': arrays['escape'],
+            'eliciting_virus': pd.Categorical.from_codes(
+                arrays['eliciting_virus'], arrays['eliciting_virus_names']
+            ),
+            'known_to_neutralize': pd.Categorical.from_codes(
+                arrays['known_to_neutralize'], arrays['known_to_neutralize_names']
+            ),
+            'neg_log_IC50': arrays['neg_log_IC50'],
+        },
+        index=arrays['index'],
+    )
+
+
+def _read_compiled_snapshot(snapshot_dir):
+    """Memory map compiled arrays from snapshot written by :func:`write_snapshot`."""
+    compiled = {}
+    for name in _SNAPSHOT_COMPILED:
+        compiled[name] = np.load(os.path.join(snapshot_dir, f"compiled_{name}.npy"),
+                                 mmap_mode='r')
+    compiled['conditions'] = compiled['conditions'].astype(object)
+    compiled['condition_configs'] = pd.DataFrame({
+        col: np.load(os.path.join(snapshot_dir, f"compiled_condition_configs_{col}.npy"))
+        for col in _SNAPSHOT_CONDITION_CONFIGS
+    }).astype({col: object for col in _SNAPSHOT_CONDITION_CONFIGS if col != 'neg_log_IC50'})
+    return compiled
+
+
+class DataCache:
+    """Local content-addressed cache of escape data downloaded from URLs.
+
+    Each downloaded CSV is stored as a snapshot (see :func:`write_snapshot`)
+    named by the SHA-256 hash of its content, so repeatedly creating
+    calculators from a URL skips both the download and the parsing. The
+    cache is checked for updates at most every `max_age` seconds with a
+    conditional request using the ETag or last-modified time from the server,
+    and if the check fails the cached data are used with a warning. Least
+    recently used snapshots are evicted when the cache exceeds `max_size_mb`.
+
+    Parameters
+    ----------
+    cache_dir : str or None
+        Cache directory. If `None`, the ``BINDINGCALCULATOR_CACHE_DIR``
+        environment variable if set, else ``bindingcalculator`` in
+        ``$XDG_CACHE_HOME`` or ``~/.cache``.
+    max_size_mb : float
+        Maximum total size of cached snapshots in megabytes. The most recently
+        used snapshot is kept even if it alone exceeds this.
+    max_age : float
+        Seconds after which the source is checked for updates.
+    offline : bool or None
+        Never access the network, raising an error for data not in the
+        cache. If `None`, offline if the ``BINDINGCALCULATOR_OFFLINE``
+        environment variable is set to a value other than 0.
+
+    Example
+    -------
+    In offline mode, data not yet in the cache are an error:
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as cache_dir:
+    ...     DataCache(cache_dir, offline=True).snapshot('https://example.org/escape.csv')
+    Traceback (most recent call last):
+    ...
+    FileNotFoundError: https://example.org/escape.csv is not cached and cache is offline
+
+    """
+    _ORPHAN_GRACE = 3600  # seconds before snapshots not in the index are removed
+
+    def __init__(self, cache_dir=None, *, max_size_mb=1000, max_age=86400, offline=None):
+        """See main class docstring."""
+        if cache_dir is None:
+            cache_dir = os.environ.get('BINDINGCALCULATOR_CACHE_DIR') or os.path.join(
+                os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                'bindingcalculator',
+            )
+        if offline is None:
+            offline = os.environ.get('BINDINGCALCULATOR_OFFLINE', '0') not in {'', '0'}
+        self.cache_dir = cache_dir
+        self.max_size_mb = max_size_mb
+        self.max_age = max_age
+        self.offline = offline
+
+    def _snapshot_dir(self, sha256):
+        """Directory of snapshot of data with hash `sha256`."""
+        return os.path.join(self.cache_dir, 'snapshots', sha256)
+
+    def _read_index(self):
+        """Dict keyed by URL of the cached data for that URL."""
+        try:
+            with open(os.path.join(self.cache_dir, 'index.json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_index(self, index):
+        """Atomically replace the index."""
+        with tempfile.NamedTemporaryFile('w', dir=self.cache_dir, delete=False) as f:
+            json.dump(index, f, indent=2)
+        os.replace(f.name, os.path.join(self.cache_dir, 'index.json'))
+
+    def snapshot(self, url):
+        """Path to snapshot of the escape data at `url`, downloading them if needed.
+
+        Parameters
+        ----------
+        url : str
+            URL of escape data CSV.
+
+        Returns
+        -------
+        str
+            Snapshot directory, which can be passed to :class:`BindingCalculator`.
+
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        index = self._read_index()
+        entry = index.get(url)
+        if entry is not None and not os.path.isdir(self._snapshot_dir(entry['sha256'])):
+            entry = None
+        if entry is None:
+            if self.offline:
+                raise FileNotFoundError(f"{url} is not cached and cache is offline")
+            entry = self._fetch(url)
+        elif not self.offline and time.time() - entry['checked'] > self.max_age:
+            try:
+                entry = self._fetch(url, entry)
+            except OSError as e:
+                warnings.warn(f"could not check {url} for updates, using cached data: {e}")
+        entry['used'] = time.time()
+        index = self._read_index()  # another process may have updated it while fetching
+        index[url] = entry
+        self._evict(index, url)
+        self._write_index(index)
+        return self._snapshot_dir(entry['sha256'])
+
+    def _fetch(self, url, entry=None):
+        """Download data at `url` if changed from cached `entry`, returning new entry."""
+        request = urllib.request.Request(url)
+        if entry is not None and entry.get('etag'):
+            request.add_header('If-None-Match', entry['etag'])
+        if entry is not None and entry.get('last_modified'):
+            request.add_header('If-Modified-Since', entry['last_modified'])
+        try:
+            response = urllib.request.urlopen(request, timeout=60)
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and entry is not None:
+                return {**entry, 'checked': time.time()}
+            raise
+        h = hashlib.sha256()
+        with response, tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix='.csv') as f:
+            for block in iter(lambda: response.read(1 << 20), b''):
+                h.update(block)
+                f.write(block)
+            f.flush()
+            sha256 = h.hexdigest()
+            snapshot_dir = self._snapshot_dir(sha256)
+            if not os.path.isdir(snapshot_dir):
+                # write to temporary directory and rename, as other processes may share the cache
+                tmp_dir = tempfile.mkdtemp(dir=self.cache_dir)
+                try:
+                    write_snapshot(f.name, tmp_dir)
+                    os.makedirs(os.path.dirname(snapshot_dir), exist_ok=True)
+                    os.rename(tmp_dir, snapshot_dir)
+                except OSError:
+                    if not os.path.isdir(snapshot_dir):
+                        raise
+                finally:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+        return {'sha256': sha256,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'checked': time.time(),
+                }
+
+    def _evict(self, index, keep_url):
+        """Remove snapshots not in `index`, then least recently used ones until under size limit.
+
+        Snapshots not in `index` are only removed once older than `_ORPHAN_GRACE`
+        seconds, as another process may have just written one and not yet
+        added it to the index.
+
+        """
+        snapshots_dir = os.path.join(self.cache_dir, 'snapshots')
+        sizes = {}
+        orphans = set()
+        in_use = {entry['sha256'] for entry in index.values()}
+        for sha256 in os.listdir(snapshots_dir):
+            snapshot_dir = os.path.join(snapshots_dir, sha256)
+            sizes[sha256] = sum(entry.stat().st_size for entry in os.scandir(snapshot_dir))
+            if (sha256 not in in_use
+                    and time.time() - os.stat(snapshot_dir).st_mtime > self._ORPHAN_GRACE):
+                orphans.add(sha256)
+        for sha256 in orphans:
+            shutil.rmtree(os.path.join(snapshots_dir, sha256), ignore_errors=True)
+            del sizes[sha256]
+        total = sum(sizes.values())
+        for url in sorted(index, key=lambda url: index[url]['used']):
+            if total <= self.max_size_mb * 1e6:
+                break
+            sha256 = index[url]['sha256']
+            if url == keep_url or sha256 == index[keep_url]['sha256']:
+                continue
+            del index[url]
+            if sha256 in sizes and sha256 not in {entry['sha256'] for entry in index.values()}:
+                shutil.rmtree(os.path.join(snapshots_dir, sha256), ignore_errors=True)
+                total -= sizes.pop(sha256)
+
+    def clear(self):
+        """Remove all cached data."""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+def _is_unwritable(error):
+    """Whether `error` is from writing to a read-only location."""
+    return isinstance(error, PermissionError) or error.errno == errno.EROFS
+
+
+class ScoringServer:
+    """Local asyncio HTTP server scoring variants in micro-batches.
+
+    Requests arriving within `batch_window` seconds of each other are scored
+    together in one vectorized pass of the calculator, off the event loop.
+
+    The server answers ``POST /binding_retained`` with a JSON body such as
+    ``{"mutated_sites": [417, 484], "escape_per_site": true}`` (the second key
+    is optional) with JSON giving 'binding_retained' and, if requested,
+    'escape_per_site' as a list of records like those from
+    :meth:`BindingCalculator.escape_per_site`. ``GET /stats`` returns the
+    statistics from :meth:`ScoringServer.stats`.
+
+    Parameters
+    ----------
+    calculator : :class:`BindingCalculator`
+        Calculator used for scoring.
+    batch_window : float
+        Seconds to wait after the first request of a batch for more requests.
+    max_batch_size : int
+        Score a batch as soon as it has this many requests.
+    n_latencies : int
+        Number of most recent request latencies kept for percentiles.
+
+    Example
+    -------
+    Requests can also be scored directly without HTTP:
+
+    >>> import io
+    >>> csv = io.StringIO(
+    ...     "condition,site,escape,eliciting_virus,known_to_neutralize,neg_log_IC50\\n"
+    ...     "A,484,1.0,SARS-CoV-2,Wuhan-Hu-1;any,1;1\\n"
+    ...     "B,484,0.5,SARS-CoV-2,Wuhan-Hu-1;any,3;3\\n"
+    ...     "B,417,1.0,SARS-CoV-2,Wuhan-Hu-1;any,3;3\\n"
+    ... )
+    >>> server = ScoringServer(BindingCalculator(csv, weight_by_log_IC50=False))
+    >>> async def score_two():
+    ...     return await asyncio.gather(server.score([484]), server.score([]))
+    >>> asyncio.run(score_two())
+    [{'binding_retained': 0.125}, {'binding_retained': 1.0}]
+    >>> stats = server.stats()
+    >>> stats['requests'], stats['batch_sizes']
+    (2, {2: 1})
+
+    """
+    def __init__(self, calculator, *, batch_window=0.005, max_batch_size=1000, n_latencies=10000):
+        """See main class docstring."""
+        self.calculator = calculator
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._flush_handle = None
+        self._n_requests = 0
+        self._batch_sizes = collections.Counter()
+        self._latencies = collections.deque(maxlen=n_latencies)
+        mask = calculator._site_mask
+        self._escape = calculator._escape[:, mask]
+        self._escape_sites = calculator._sites[mask].tolist()
+        self._original_escape = calculator._weights @ self._escape / calculator._n_conditions
+
+    def stats(self):
+        """Request, batch-size, and latency statistics.
+
+        Returns
+        -------
+        dict
+            Keyed by 'requests' (total number), 'batch_sizes' (number of batches
+            of each size), and 'latency_ms' (50th, 90th, and 99th percentiles in
+            milliseconds of recent request latencies).
+
+        """
+        if self._latencies:
+            percentiles = np.percentile(np.array(self._latencies) * 1000, [50, 90, 99])
+        else:
+            percentiles = [np.nan] * 3
+        return {'requests': self._n_requests,
+                'batch_sizes': dict(sorted(self._batch_sizes.items())),
+                'latency_ms': dict(zip(['p50', 'p90', 'p99'], map(float, percentiles))),
+                }
+
+    async def score(self, mutated_sites, *, escape_per_site=False):
+        """Score one variant as part of the next micro-batch.
+
+        Parameters
+        ----------
+        mutated_sites : array-like of integers
+            List of mutated sites, must all be in :attr:`BindingCalculator.sites`.
+        escape_per_site : bool
+            Also return escape at each site.
+
+        Returns
+        -------
+        dict
+            Keyed by 'binding_retained' and, if requested, 'escape_per_site'.
+
+        """
+        start = time.perf_counter()
+        mutated_sites = self._validated_sites(mutated_sites)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((mutated_sites, escape_per_site, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        result = await future
+        self._latencies.append(time.perf_counter() - start)
+        return result
+
+    def _validated_sites(self, mutated_sites):
+        """List of integer `mutated_sites`, raising an error unless all in calculator sites."""
+        mutated_sites = [int(site) for site in mutated_sites]
+        if not set(mutated_sites).issubset(self.calculator.sites):
+            raise ValueError(f"invalid sites: {set(mutated_sites) - self.calculator.sites}")
+        return mutated_sites
+
+    def _flush(self):
+        """Start scoring pending requests as one batch."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        self._n_requests += len(batch)
+        self._batch_sizes[len(batch)] += 1
+        loop = asyncio.get_running_loop()
+        task = loop.run_in_executor(None, self._score_batch, batch)
+        task.add_done_callback(functools.partial(self._set_results, batch))
+
+    @staticmethod
+    def _set_results(batch, task):
+        """Resolve futures of requests in `batch` from the completed scoring `task`."""
+        for i, (_, _, future) in enumerate(batch):
+            if future.cancelled():
+                continue
+            if task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result()[i])
+
+    def _score_batch(self, batch):
+        """Results for a batch of requests, scored in one vectorized pass."""
+        calc = self.calculator
+        cond_bind_retain = calc._cond_bind_retain_matrix(
+            *calc._data._mutated_indices([sites for sites, _, _ in batch], calc.sites)
+        )
+        binding_retained = cond_bind_retain @ calc._weights / calc._n_conditions
+        results = [{'binding_retained': float(b)} for b in binding_retained]
+        iescape = [i for i, (_, escape_per_site, _) in enumerate(batch) if escape_per_site]
+        if iescape:
+            retained_escape = (
+                (cond_bind_retain[iescape] * calc._weights) @ self._escape / calc._n_conditions
+            )
+            for i, retained in zip(iescape, retained_escape):
+                results[i]['escape_per_site'] = [
+                    {'site': site, 'original_escape': float(orig), 'retained_escape': float(ret)}
+                    for site, orig, ret in zip(self._escape_sites, self._original_escape, retained)
+                ]
+        return results
+
+    async def _handle(self, request_line, body):
+        """HTTP status and JSON response for a request, errors in scoring are raised."""
+        try:
+            method, path, _ = request_line.split(' ', 2)
+        except ValueError:
+            return 400, {'error': 'malformed request line'}
+        if method == 'GET' and path == '/stats':
+            return 200, self.stats()
+        if path != '/binding_retained':
+            return 404, {'error': f"unknown path {path}"}
+        if method != 'POST':
+            return 405, {'error': f"{method} not allowed"}
+        try:
+            request = json.loads(body)
+            mutated_sites = self._validated_sites(request['mutated_sites'])
+            escape_per_site = bool(request.get('escape_per_site'))
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {'error': str(e)}
+        return 200, await self.score(mutated_sites, escape_per_site=escape_per_site)
+
+    async def _handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on a connection until it is closed."""
+        try:
+            while request_line := (await reader.readline()).decode().strip():
+                headers = {}
+                while (line := (await reader.readline()).decode().strip()):
+                    key, _, value = line.partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                close = headers.get('connection', '').lower() == 'close'
+                try:
+                    content_length = int(headers.get('content-length', 0))
+                    if content_length < 0:
+                        raise ValueError(f"negative {content_length=}")
+                except ValueError:
+                    # the end of the body is unknown, so the connection cannot be reused
+                    status, response = 400, {'error': 'invalid Content-Length'}
+                    close = True
+                else:
+                    body = await reader.readexactly(content_length)
+                    try:
+                        status, response = await self._handle(request_line, body)
+                    except Exception as e:
+                        print(f"Error handling {request_line!r}: {e!r}", file=sys.stderr)
+                        status, response = 500, {'error': f"internal error: {e}"}
+                payload = json.dumps(response).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        """Serve requests on `host` and `port` until cancelled."""
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host='127.0.0.1', port=8000):
+        """Run :meth:`ScoringServer.serve` in a new event loop."""
+        asyncio.run(self.serve(host, port))
+
+
+def sequence_mutated_sites(sequence, first_site=331):
+    """Sites at which an RBD sequence differs from the Wuhan-Hu-1 reference.
+
+    Parameters
+    ----------
+    sequence : str
+        Protein sequence aligned to the reference (no insertions), with '-'
+        for deleted sites, which count as mutated, and 'X' for ambiguous sites,
+        which do not.
+    first_site : int
+        Site number of the first residue of `sequence` in the reference numbering.
+
+    Returns
+    -------
+    list
+        The mutated sites.
+
+    >>> sequence_mutated_sites('NITNLCPFGE', first_site=331)
+    []
+    >>> sequence_mutated_sites('NITNLCPFGEVFNATRF-SVYAWNRK', first_site=331)
+    [348]
+
+    """
+    start = first_site - _RBD_REFERENCE_FIRST_SITE
+    if start < 0 or start + len(sequence) > len(_RBD_REFERENCE):
+        raise ValueError(
+            f"sequence of length {len(sequence)} starting at {first_site=} extends "
+            f"beyond reference sites {_RBD_REFERENCE_FIRST_SITE} to "
+            f"{_RBD_REFERENCE_FIRST_SITE + len(_RBD_REFERENCE) - 1}"
+        )
+    return [first_site + i for i, (aa, wt) in
+            enumerate(zip(sequence.upper(), _RBD_REFERENCE[start:]))
+            if aa != wt and aa != 'X']
+
+
+def _read_fasta(f):
+    """Yield `(name, sequence)` for each record in FASTA file handle `f`."""
+    name, seq = None, []
+    for line in f:
+        line = line.strip()
+        if line.startswith('>'):
+            if name is not None:
+                yield name, ''.join(seq)
+            name, seq = line[1:].strip(), []
+        elif line:
+            if name is None:
+                raise ValueError("FASTA file does not start with a header line")
+            seq.append(line)
+    if name is not None:
+        yield name, ''.join(seq)
+
+
+_WORKER_CALCULATOR = None
+
+
+def _init_worker(csv_or_url, kwargs):
+    """Construct the calculator used by :func:`_score_batch` in this process."""
+    global _WORKER_CALCULATOR
+    _WORKER_CALCULATOR = BindingCalculator(csv_or_url, **kwargs)
+
+
+def _score_batch(haplotypes):
+    """Binding retained for list of haplotypes with calculator from :func:`_init_worker`."""
+    return _WORKER_CALCULATOR.binding_retained_many(haplotypes)
+
+
+def _iter_variant_chunks(args):
+    """Yield data frames of chunks of input variants with mutated sites in column `args.sites_col`.
+
+    Only mutated sites in `args.sites`, those with escape data, are kept.
+
+    """
+    fmt = args.format
+    if fmt is None:
+        fmt = 'fasta' if args.input.endswith(('.fa', '.fasta', '.faa')) else 'table'
+    f = sys.stdin if args.input == '-' else open(args.input)
+    try:
+        if fmt == 'fasta':
+            records = _read_fasta(f)
+            while chunk := list(itertools.islice(records, args.chunksize)):
+                yield pd.DataFrame({
+                    'name': [name for name, _ in chunk],
+                    args.sites_col: [
+                        [site for site in sequence_mutated_sites(seq, args.first_site)
+                         if site in args.sites]
+                        for _, seq in chunk
+                    ],
+                })
+        else:
+            sep = '\t' if args.tsv or args.input.endswith('.tsv') else ','
+            for chunk in pd.read_csv(f, sep=sep, chunksize=args.chunksize, dtype=str,
+                                     keep_default_na=False):
+                if args.sites_col not in chunk.columns:
+                    raise ValueError(f"no column {args.sites_col} in {args.input}")
+                # as for FASTA, sites without escape data have no effect and are dropped
+                chunk[args.sites_col] = [
+                    [site for site in map(int, filter(None, re.split(r'[\s,;]+', sites.strip())))
+                     if site in args.sites]
+                    for sites in chunk[args.sites_col]
+                ]
+                yield chunk
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _main(argv=None):
+    """Score variants from the command line, see ``python bindingcalculator.py --help``."""
+    parser = argparse.ArgumentParser(
+        description='Calculate binding retained for a table of variants or a FASTA of '
+                    'RBD sequences, or run the doctests if there is no input.',
+    )
+    parser.add_argument('input', nargs='?',
+                        help="CSV or TSV (if ending in '.tsv') with a column of mutated "
+                             "sites, or FASTA of RBD sequences; '-' for standard input")
+    parser.add_argument('-o', '--output', default='-',
+                        help="output CSV, or TSV if ending in '.tsv'; default standard output")
+    parser.add_argument('--format', choices=['table', 'fasta'],
+                        help="input format, by default FASTA if ending in '.fa' or '.fasta'")
+    parser.add_argument('--tsv', action='store_true',
+                        help="input table is TSV, as assumed if it ends in '.tsv'")
+    parser.add_argument('--sites-col', default='mutated_sites',
+                        help='column of mutated sites separated by spaces, commas or semicolons; '
+                             'sites without escape data are dropped')
+    parser.add_argument('--first-site', type=int, default=331,
+                        help='site number of first residue of FASTA sequences, which are '
+                             'aligned to the Wuhan-Hu-1 RBD numbering of 6M0J')
+    parser.add_argument('--data', default=_ESCAPE_CALCULATOR_DATA_URL,
+                        help='escape data CSV, URL, or snapshot directory')
+    parser.add_argument('--cache-dir',
+                        help='cache for escape data from a URL, see DataCache for default')
+    parser.add_argument('--offline', action='store_true',
+                        help='only use cached escape data from a URL, never the network')
+    parser.add_argument('--eliciting-virus', default='SARS-CoV-2')
+    parser.add_argument('--known-to-neutralize', default='any')
+    parser.add_argument('--no-weight-by-log-IC50', action='store_true')
+    parser.add_argument('--mutation-escape-strength', type=float, default=2)
+    parser.add_argument('--chunksize', type=int, default=10000,
+                        help='number of variants read and written at a time')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of processes scoring each chunk in parallel')
+    parser.add_argument('--max-cached', type=int, default=100000,
+                        help='number of most recently seen distinct variants whose scores '
+                             'are kept to avoid rescoring them')
+    parser.add_argument('--serve', action='store_true',
+                        help='instead of scoring input, run a local scoring server')
+    parser.add_argument('--host', default='127.0.0.1', help='host for --serve')
+    parser.add_argument('--port', type=int, default=8000, help='port for --serve')
+    parser.add_argument('--batch-window', type=float, default=0.005,
+                        help='seconds --serve waits to batch concurrent requests')
+    args = parser.parse_args(argv)
+
+    cache = DataCache(args.cache_dir, offline=args.offline or None)
+    if args.serve:
+        calculator = BindingCalculator(
+            args.data,
+            eliciting_virus=args.eliciting_virus,
+            known_to_neutralize=args.known_to_neutralize,
+            weight_by_log_IC50=not args.no_weight_by_log_IC50,
+            mutation_escape_strength=args.mutation_escape_strength,
+            cache=cache,
+        )
+        server = ScoringServer(calculator, batch_window=args.batch_window)
+        print(f"Serving on http://{args.host}:{args.port}", file=sys.stderr)
+        server.run(args.host, args.port)
+        return
+
+    if args.input is None:
+        import doctest
+        doctest.testmod()
+        return
+
+    start = time.perf_counter()
+    kwargs = {'eliciting_virus': args.eliciting_virus,
+              'known_to_neutralize': args.known_to_neutralize,
+              'weight_by_log_IC50': not args.no_weight_by_log_IC50,
+              'mutation_escape_strength': args.mutation_escape_strength,
+              'cache_size': 0,
+              'cache': cache,
+              }
+    _init_worker(args.data, kwargs)
+    args.sites = _WORKER_CALCULATOR.sites
+    if args.processes > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            args.processes, initializer=_init_worker, initargs=(args.data, kwargs)
+        )
+    else:
+        executor = None
+
+    # binding retained of the most recently seen distinct haplotypes, least recent first
+    scored = collections.OrderedDict()
+    n_variants = 0
+    n_scored = 0
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    out_sep = '\t' if args.output.endswith('.tsv') else ','
+    try:
+        for ichunk, chunk in enumerate(_iter_variant_chunks(args)):
+            haplotypes = [tuple(sorted(set(sites))) for sites in chunk[args.sites_col]]
+            chunk_scored = {}
+            for h in haplotypes:
+                if h not in chunk_scored and h in scored:
+                    scored.move_to_end(h)
+                    chunk_scored[h] = scored[h]
+            new = list(dict.fromkeys(h for h in haplotypes if h not in chunk_scored))
+            if executor is None:
+                results = [_score_batch(new)]
+            else:
+                batchsize = max(1, -(-len(new) // args.processes))
+                results = executor.map(
+                    _score_batch,
+                    [new[i: i + batchsize] for i in range(0, len(new), batchsize)],
+                )
+            for h, binding_retained in zip(new, itertools.chain.from_iterable(results)):
+                chunk_scored[h] = scored[h] = binding_retained
+            while len(scored) > args.max_cached:
+                scored.popitem(last=False)
+            chunk[args.sites_col] = [' '.join(map(str, h)) for h in haplotypes]
+            chunk['binding_retained'] = [chunk_scored[h] for h in haplotypes]
+            chunk.to_csv(out, sep=out_sep, index=False, header=ichunk == 0)
+            n_variants += len(chunk)
+            n_scored += len(new)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if executor is not None:
+            executor.shutdown()
+
+    elapsed = time.perf_counter() - start
+    print(f"Scored {n_variants} variants ({n_scored} after removing repeats) in "
+          f"{elapsed:.1f} seconds, {n_variants / elapsed:.0f} variants per second.",
+          file=sys.stderr)
+
 
 if __name__ == '__main__':
-    import doctest
-    doctest.testmod()
+    _main()
@@ -1,15 +1,25 @@
 """Process input data to make merged CSVs with all data."""
 
 
+import argparse
+import concurrent.futures
+import hashlib
+import itertools
 import os
+import shutil
+import sqlite3
 import string
+import sys
+import tracemalloc
 
-from dmslogo.utils import AxLimSetter
+import numpy as np
 
 import pandas as pd
 
 import ruamel.yaml
 
+from bindingcalculator import Instrumentation, instrumented_stage
+
 
 def valid_year(year):
     """Return `True` if and only if valid year betweeen 2000 and 2030."""
@@ -18,8 +28,33 @@ def valid_year(year):
     return 2000 <= year <= 2030
 
 
-def process_study(study_yaml, data_csv):
-    """Parse data from specific study."""
+# compact dtypes for columns of the processed data, strings repeated on many
+# rows are categorical; `mut_escape` stays 64-bit as it is summed and normalized
+DTYPES = {'condition': 'category',
+          'condition_type': 'category',
+          'condition_subtype': 'category',
+          'condition_year': 'int16',
+          'condition_alias': 'category',
+          'eliciting_virus': 'category',
+          'known_to_neutralize': 'category',
+          'IC50s': 'category',
+          'site': 'int16',
+          'wildtype': 'category',
+          'mutation': 'category',
+          'mut_escape': 'float64',
+          'study': 'category',
+          'lab': 'category',
+          }
+
+
+def process_study(study_yaml, data_csv, chunksize=500000):
+    """Parse data from specific study.
+
+    The data CSV is read in chunks of `chunksize` rows, dropping zero
+    `mut_escape` values from each chunk, and the returned data use the
+    compact dtypes in `DTYPES`.
+
+    """
     # read YAML file on study
     with open(study_yaml) as f:
         study = ruamel.yaml.YAML(typ='safe').load(f)
@@ -94,20 +129,37 @@ def process_study(study_yaml, data_csv):
                                        'known_to_neutralize', "IC50s"])
 
     # process the data, dropping any zero mut_escape values
-    data = pd.read_csv(data_csv).query("mut_escape != 0")
-    if 'condition' not in data.columns:
+    cols = ['condition', 'site', 'wildtype', 'mutation', 'mut_escape']
+    header = pd.read_csv(data_csv, nrows=0).columns
+    if 'condition' not in header:
         raise ValueError(f"{data_csv} lacks column `condition`")
+    for col in cols:
+        if col not in header:
+            raise ValueError(f"{data_csv} lacks column `{col}`")
+    data = pd.concat(
+        [chunk.query("mut_escape != 0")
+         for chunk in pd.read_csv(data_csv,
+                                  usecols=cols,
+                                  dtype={'condition': str,
+                                         'site': DTYPES['site'],
+                                         'wildtype': str,
+                                         'mutation': str,
+                                         'mut_escape': DTYPES['mut_escape'],
+                                         },
+                                  chunksize=chunksize,
+                                  )],
+        ignore_index=True,
+    )[cols]
     if set(data['condition']) != set(conditions['condition']):
         raise ValueError(f"conditions in {study_yaml} do not match those in "
                          f"{data_csv}:\n" +
                          str(set(data['condition']).symmetric_difference(
                                 set(conditions['condition']))))
-    cols = ['condition', 'site', 'wildtype', 'mutation', 'mut_escape']
-    for col in cols:
-        if col not in data.columns:
-            raise ValueError(f"{data_csv} lacks column `{col}`")
-    data = data[cols]
-    data = conditions.merge(data, on='condition', validate='one_to_many')
+    data = (
+        conditions
+        .merge(data, on='condition', validate='one_to_many')
+        .astype({col: dtype for col, dtype in DTYPES.items() if col not in {'study', 'lab'}})
+    )
 
     # get general information on study
     first_author = study['study_first_author']
@@ -123,91 +175,659 @@ def process_study(study_yaml, data_csv):
     return (first_author, study_year, study_journal, url, lab, data)
 
 
+def process_subdir(subdir, study_yaml_base, data_csv_base):
+    """Parse data from study in subdirectory, adding `study` and `lab` columns."""
+    study_yaml = os.path.join(subdir, study_yaml_base)
+    data_csv = os.path.join(subdir, data_csv_base)
+    for f in [study_yaml, data_csv]:
+        if not os.path.isfile(f):
+            raise IOError(f"Missing file {f}")
+    first_author, year, jrnl, url, lab, data = process_study(study_yaml,
+                                                             data_csv)
+    # make sure directory has appropriate prefix / suffix
+    study = os.path.basename(subdir)
+    if not study.startswith(f"{year}_{first_author}_"):
+        raise ValueError(f"{subdir} should start with "
+                         f"{year}_{first_author} to reflect year "
+                         'and first author')
+    data = data.assign(study=study,
+                       lab=lab).astype({'study': DTYPES['study'], 'lab': DTYPES['lab']})
+    return (study, first_author, year, jrnl, url, lab, data)
+
+
+def normalize_by_group(values, groups, *, quantile, frac, min_upperlim):
+    """Normalize values in each group to a max of one and then by a quantile-based limit.
+
+    The values in each group are divided by their max, and then by the upper
+    limit that ``dmslogo.utils.AxLimSetter`` gives for those scaled values
+    with ``datalim_pad=0``, ``include_zero=True``, ``min_upperlim=min_upperlim``
+    and ``max_from_quantile=(quantile, frac)``. All groups are handled at once
+    with vectorized operations on the values sorted within groups.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Values to normalize.
+    groups : numpy.ndarray
+        Integer group of each value.
+    quantile : float
+        Quantile of the scaled values in each group that is `frac` of the way
+        from the lower limit (zero or the min) to the upper limit.
+    frac : float
+        See `quantile`.
+    min_upperlim : float
+        Upper limit is at least this large.
+
+    Returns
+    -------
+    numpy.ndarray
+        Normalized values, in the same order as `values`.
+
+    Example
+    -------
+    >>> from dmslogo.utils import AxLimSetter
+    >>> values = np.array([0.2, 2, 0.6, 0.4, 0.02, 0.04, 1, 0.01, 0.3])
+    >>> groups = np.array([0, 0, 0, 1, 1, 1, 1, 1, 2])
+    >>> normalized = normalize_by_group(values, groups, quantile=0.5, frac=0.05,
+    ...                                 min_upperlim=1)
+    >>> limset = AxLimSetter(datalim_pad=0, include_zero=True, min_upperlim=1,
+    ...                      max_from_quantile=(0.5, 0.05))
+    >>> expected = np.concatenate([
+    ...     values[groups == g] / values[groups == g].max()
+    ...     / limset.get_lims(values[groups == g] / values[groups == g].max())[1]
+    ...     for g in [0, 1, 2]
+    ... ])
+    >>> bool(np.array_equal(normalized, expected))
+    True
+
+    """
+    # scale values by max in each group
+    order = np.argsort(groups, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(groups[order]) != 0])
+    group_max = np.maximum.reduceat(values[order], starts)
+    group_index = np.empty(len(values), dtype=int)
+    group_index[order] = np.repeat(np.arange(len(starts)),
+                                   np.diff(np.r_[starts, len(values)]))
+    scaled = values / group_max[group_index]
+
+    # sort scaled values within each group to get min, max, and quantile
+    order = np.lexsort((scaled, group_index))
+    sorted_scaled = scaled[order]
+    counts = np.diff(np.r_[starts, len(values)])
+    datamin = np.minimum(0, sorted_scaled[starts])
+    datamax = np.maximum(0, sorted_scaled[starts + counts - 1])
+    # linear interpolation of quantile exactly as done by numpy.quantile
+    virtual_index = quantile * (counts - 1)
+    lower = np.floor(virtual_index).astype(int)
+    upper = np.minimum(lower + 1, counts - 1)
+    t = virtual_index - lower
+    a = sorted_scaled[starts + lower]
+    b = sorted_scaled[starts + upper]
+    quantile_val = np.where(t >= 0.5, b - (b - a) * (1 - t), a + (b - a) * t)
+    upperlim = np.maximum(datamax, datamin + (quantile_val - datamin) / frac)
+    upperlim = np.where(upperlim == datamin, upperlim + 0.001, upperlim)
+    upperlim = np.maximum(upperlim, min_upperlim)
+    return scaled / upperlim[group_index]
+
+
+def add_site_escape(data, instrumentation=None):
+    """Add normalized site-level escape and `dms-view` columns to data for a study.
+
+    Site-level escape is normalized separately for each condition and study,
+    so studies can be processed independently. The 'site_aggregation',
+    'normalization' and 'merge' stages are recorded if `instrumentation` is
+    a ``bindingcalculator.Instrumentation``.
+
+    """
+    # ignore antibody cocktail data
+    data = data.query('condition_type != "antibody cocktail"')
+
+    # compute site-level escape
+    with instrumented_stage(instrumentation, 'site_aggregation') as stage:
+        assert len(data) == len(data.groupby(['condition', 'study',
+                                              'site', 'mutation'], observed=True))
+        site_data = (
+            data
+            .groupby(['condition', 'study', 'site'],
+                     as_index=False, dropna=False, observed=True)
+            .aggregate(site_total_escape=pd.NamedAgg('mut_escape', 'sum'))
+            )
+        stage['rows'] = len(site_data)
+
+    # Normalize site-level escape, first setting to one for each condition,
+    # and then further adjusting so that median value is at no greater than 0.5
+    with instrumented_stage(instrumentation, 'normalization') as stage:
+        assert len(site_data) == len(site_data.groupby(['condition', 'study', 'site'],
+                                                       observed=True))
+        for col in ['site_total_escape']:
+            site_data[col] = normalize_by_group(
+                site_data[col].to_numpy(),
+                site_data.groupby(['condition', 'study'], observed=True).ngroup().to_numpy(),
+                quantile=0.5,
+                frac=0.05,
+                min_upperlim=1,
+            )
+        stage['rows'] = len(site_data)
+
+    # merge site data into data frame and add other `dms-view` columns
+    with instrumented_stage(instrumentation, 'merge') as stage:
+        data = (
+            data
+            .merge(site_data)
+            .assign(label_site=lambda x: x['wildtype'].astype(str) + x['site'].astype(str),
+                    protein_site=lambda x: x['site'],
+                    protein_chain='E',  # for PDB 6moj
+                    )
+            )
+        stage['rows'] = len(data)
+    return data
+
+
+def build_study(subdir, study_yaml_base, data_csv_base, instrument=False, trace_memory=True):
+    """Fully process study in subdirectory.
+
+    If `instrument` is `True`, the 'parse_validate' stage and those of
+    :func:`add_site_escape` are recorded, tracing memory if `trace_memory`.
+
+    Returns
+    -------
+    tuple
+        `(study_info, n_conditions, data, records)` where `study_info` is the
+        tuple `(study, first_author, year, journal, url, lab)`, `n_conditions`
+        is the number of conditions in the input data, `data` has the
+        processed data for the study, and `records` is a list of the records
+        of the stages (empty unless `instrument`).
+
+    """
+    records = []
+    if instrument:
+        instrumentation = Instrumentation(records.append, trace_memory=trace_memory)
+    else:
+        instrumentation = None
+    with instrumented_stage(instrumentation, 'parse_validate') as stage:
+        study, first_author, year, jrnl, url, lab, data = process_subdir(
+            subdir, study_yaml_base, data_csv_base
+        )
+        stage['rows'] = len(data)
+    return ((study, first_author, year, jrnl, url, lab),
+            data['condition'].nunique(),
+            add_site_escape(data, instrumentation),
+            records)
+
+
+def iter_subdirs(subdirs, study_yaml_base, data_csv_base, processes=1,
+                 instrument=False, trace_memory=True):
+    """Yield results of :func:`build_study` for each subdirectory in order.
+
+    If `processes` is greater than one, subdirectories are processed in
+    parallel in that many processes.
+
+    """
+    args = (subdirs, itertools.repeat(study_yaml_base), itertools.repeat(data_csv_base),
+            itertools.repeat(instrument), itertools.repeat(trace_memory))
+    if processes > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            yield from executor.map(build_study, *args)
+    else:
+        yield from map(build_study, *args)
+
+
+def study_hash(subdir, study_yaml_base, data_csv_base):
+    """Hash of the input files for a study, the code processing them, and the pandas version."""
+    h = hashlib.sha256()
+    # pickled processed data may not load with other versions of pandas or numpy
+    h.update(f"pandas {pd.__version__}\0numpy {np.__version__}\0".encode())
+    for f in [__file__,
+              os.path.join(subdir, study_yaml_base),
+              os.path.join(subdir, data_csv_base)]:
+        h.update(f"{os.path.basename(f)}\0".encode())
+        if os.path.isfile(f):
+            with open(f, 'rb') as fh:
+                for block in iter(lambda: fh.read(1 << 20), b''):
+                    h.update(block)
+    return h.hexdigest()
+
+
+def concat_categorical(dfs):
+    """Concatenate data frames, keeping categorical columns categorical.
+
+    :func:`pandas.concat` converts categorical columns with different
+    categories to strings, so the categories are first unified.
+
+    """
+    dfs = list(dfs)
+    for col in dfs[0].columns:
+        if isinstance(dfs[0][col].dtype, pd.CategoricalDtype):
+            categories = sorted(set().union(*(df[col].cat.categories for df in dfs)))
+            dfs = [df.assign(**{col: df[col].cat.set_categories(categories)})
+                   for df in dfs]
+    return pd.concat(dfs, ignore_index=True)
+
+
+def peak_memory_mb(children=False):
+    """Peak memory in MB of this process or (if `children`) its terminated child processes.
+
+    This is the peak resident memory. Where :mod:`resource` is not available,
+    as on Windows, it is instead the peak memory traced by :mod:`tracemalloc`
+    if tracing, else `None`, and always `None` for child processes.
+
+    """
+    try:
+        import resource
+    except ImportError:
+        if children or not tracemalloc.is_tracing():
+            return None
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    maxrss = resource.getrusage(
+        resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    ).ru_maxrss
+    # `ru_maxrss` is in bytes on macOS and kilobytes on Linux
+    return maxrss / 1024**2 if sys.platform == 'darwin' else maxrss / 1024
+
+
+def write_parquet(data, parquet_dir):
+    """Write processed data as a Parquet dataset partitioned by study.
+
+    Any existing dataset in `parquet_dir` is replaced. Categorical columns
+    are dictionary encoded. Requires `pyarrow`.
+
+    """
+    if os.path.isdir(parquet_dir):
+        shutil.rmtree(parquet_dir)
+    data.to_parquet(parquet_dir, partition_cols=['study'], index=False)
+
+
+def read_escape_data(parquet_dir=os.path.join('processed_data', 'escape_data_parquet'),
+                     *,
+                     columns=None,
+                     conditions=None,
+                     sites=None,
+                     condition_subtypes=None,
+                     studies=None,
+                     ):
+    """Read processed data from Parquet dataset written by :func:`write_parquet`.
+
+    Only the requested columns and the rows matching all the filters are
+    read. Filtering by study only reads the files for those studies.
+
+    Parameters
+    ----------
+    parquet_dir : str
+        Directory with the Parquet dataset.
+    columns : list or None
+        Columns to read, or `None` for all columns.
+    conditions : list or None
+        Only read these conditions.
+    sites : list or None
+        Only read these sites.
+    condition_subtypes : list or None
+        Only read these condition subtypes, such as 'class 2'.
+    studies : list or None
+        Only read these studies.
+
+    Returns
+    -------
+    pandas.DataFrame
+
+    Example
+    -------
+    >>> import tempfile
+    >>> data = pd.DataFrame({
+    ...     'condition': ['LY-CoV555', 'LY-CoV555', 'S309', 'S309'],
+    ...     'study': ['2021_Starr_Lilly'] * 2 + ['2021_Starr_VIR'] * 2,
+    ...     'site': [484, 490, 484, 337],
+    ...     'mut_escape': [0.9, 0.7, 0.01, 0.8],
+    ... })
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     write_parquet(data, os.path.join(tmpdir, 'escape_data_parquet'))
+    ...     at_site = read_escape_data(os.path.join(tmpdir, 'escape_data_parquet'),
+    ...                                columns=['condition', 'mut_escape'],
+    ...                                sites=[484])
+    ...     in_study = read_escape_data(os.path.join(tmpdir, 'escape_data_parquet'),
+    ...                                 studies=['2021_Starr_VIR'])
+    >>> at_site
+       condition  mut_escape
+    0  LY-CoV555        0.90
+    1       S309        0.01
+    >>> in_study
+      condition  site  mut_escape           study
+    0      S309   484        0.01  2021_Starr_VIR
+    1      S309   337        0.80  2021_Starr_VIR
+
+    """
+    filters = [(col, 'in', list(values))
+               for col, values in [('condition', conditions),
+                                   ('site', sites),
+                                   ('condition_subtype', condition_subtypes),
+                                   ('study', studies),
+                                   ]
+               if values is not None]
+    return pd.read_parquet(parquet_dir, columns=columns, filters=filters or None)
+
+
+def write_sqlite(data, db, chunksize=100000):
+    """Write processed data to table `escape_data` in SQLite database.
+
+    Any existing database at `db` is replaced. The table is indexed for lookups
+    by site, by condition and study, and by condition subtype and site.
+
+    """
+    if os.path.isfile(db):
+        os.remove(db)
+    with sqlite3.connect(db) as con:
+        data.to_sql('escape_data', con, index=False, chunksize=chunksize)
+        con.execute('CREATE INDEX idx_site ON escape_data (site)')
+        con.execute('CREATE INDEX idx_condition_study ON escape_data (condition, study)')
+        con.execute('CREATE INDEX idx_subtype_site ON escape_data (condition_subtype, site)')
+    con.close()
+
+
+class EscapeDataStore:
+    """Query processed data in SQLite database written by :func:`write_sqlite`.
+
+    Lookups use the database indexes, so only the matching rows are read.
+    The connection is read only, so a store can be shared between threads.
+
+    Parameters
+    ----------
+    db : str
+        Path to SQLite database, opened read only.
+
+    Example
+    -------
+    >>> import tempfile
+    >>> data = pd.DataFrame({
+    ...     'condition': ['LY-CoV555', 'LY-CoV555', 'LY-CoV555', 'S309'],
+    ...     'condition_subtype': ['class 2', 'class 2', 'class 2', 'class 3'],
+    ...     'study': ['2021_Starr_Lilly'] * 3 + ['2021_Starr_VIR'],
+    ...     'site': [452, 484, 490, 484],
+    ...     'wildtype': ['L', 'E', 'F', 'E'],
+    ...     'mutation': ['R', 'K', 'S', 'K'],
+    ...     'mut_escape': [0.5, 0.9, 0.7, 0.01],
+    ... })
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     write_sqlite(data, os.path.join(tmpdir, 'escape_data.sqlite'))
+    ...     store = EscapeDataStore(os.path.join(tmpdir, 'escape_data.sqlite'))
+    ...     try:
+    ...         site = store.site(484, condition_subtype='class 2',
+    ...                           columns=['condition', 'mut_escape'])
+    ...         condition = store.condition('S309', columns=['study', 'site'])
+    ...         mutations = store.mutations('LY-CoV555', start_site=440, end_site=485)
+    ...     finally:
+    ...         store.close()
+    >>> site
+       condition  mut_escape
+    0  LY-CoV555         0.9
+    >>> condition
+                study  site
+    0  2021_Starr_VIR   484
+    >>> mutations
+       condition             study  site wildtype mutation  mut_escape
+    0  LY-CoV555  2021_Starr_Lilly   452        L        R         0.5
+    1  LY-CoV555  2021_Starr_Lilly   484        E        K         0.9
+
+    """
+
+    def __init__(self, db):
+        """See main class docstring."""
+        if not os.path.isfile(db):
+            raise IOError(f"Missing file {db}")
+        self._con = sqlite3.connect(f"file:{db}?mode=ro", uri=True, check_same_thread=False)
+        self.columns = [row[1] for row in
+                        self._con.execute('PRAGMA table_info(escape_data)')]
+
+    def close(self):
+        """Close the database connection."""
+        self._con.close()
+
+    def _query(self, columns, where, params):
+        """Data frame of `columns` for rows matching `where` clauses with `params`."""
+        if columns is None:
+            columns = self.columns
+        invalid = set(columns) - set(self.columns)
+        if invalid:
+            raise ValueError(f"invalid columns: {invalid}")
+        sql = (f"SELECT {', '.join(f'[{col}]' for col in columns)} FROM escape_data "
+               f"WHERE {' AND '.join(where)}")
+        return pd.read_sql_query(sql, self._con, params=params)
+
+    def site(self, site, *, condition_subtype=None, columns=None):
+        """Data for all conditions at a site.
+
+        Parameters
+        ----------
+        site : int
+            Site to look up.
+        condition_subtype : str or None
+            Only get conditions of this subtype, such as 'class 2'.
+        columns : list or None
+            Columns to get, or `None` for all.
+
+        Returns
+        -------
+        pandas.DataFrame
+
+        """
+        where, params = ['site = ?'], [site]
+        if condition_subtype is not None:
+            where.insert(0, 'condition_subtype = ?')
+            params.insert(0, condition_subtype)
+        return self._query(columns, where, params)
+
+    def condition(self, condition, *, study=None, columns=None):
+        """Data for a condition.
+
+        Parameters
+        ----------
+        condition : str
+            Condition (antibody or serum) to look up.
+        study : str or None
+            Only get data from this study.
+        columns : list or None
+            Columns to get, or `None` for all.
+
+        Returns
+        -------
+        pandas.DataFrame
+
+        """
+        where, params = ['condition = ?'], [condition]
+        if study is not None:
+            where.append('study = ?')
+            params.append(study)
+        return self._query(columns, where, params)
+
+    def mutations(self, condition, *, start_site=None, end_site=None, study=None):
+        """Mutation-level escape for a condition over a range of sites.
+
+        Parameters
+        ----------
+        condition : str
+            Condition (antibody or serum) to look up.
+        start_site : int or None
+            Only get sites >= this.
+        end_site : int or None
+            Only get sites <= this.
+        study : str or None
+            Only get data from this study.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns 'condition', 'study', 'site', 'wildtype', 'mutation', and
+            'mut_escape'.
+
+        """
+        where, params = ['condition = ?'], [condition]
+        if study is not None:
+            where.append('study = ?')
+            params.append(study)
+        for op, site in [('>=', start_site), ('<=', end_site)]:
+            if site is not None:
+                where.append(f"site {op} ?")
+                params.append(site)
+        return self._query(
+            ['condition', 'study', 'site', 'wildtype', 'mutation', 'mut_escape'],
+            where,
+            params,
+        )
+
+
 def process_data(data_dir='data',
                  study_yaml_base='study.yml',
                  data_csv_base='data.csv',
+                 processes=1,
+                 cache_dir=None,
+                 parquet=False,
+                 sqlite=False,
+                 instrumentation=None,
                  ):
-    """Process the input data."""
+    """Process the input data.
+
+    Studies are parsed and validated in `processes` parallel processes if
+    it is greater than one. The output is the same regardless.
+
+    If `cache_dir` is set, the processed data for each study is cached there
+    along with a hash of its input files, and only studies whose inputs (or
+    this script) changed since the last run are reprocessed.
+
+    If `parquet` is `True`, the processed data are also written as a Parquet
+    dataset partitioned by study, which can be read with :func:`read_escape_data`.
+
+    If `sqlite` is `True`, the processed data are also written to an indexed
+    SQLite database, which can be queried with :class:`EscapeDataStore`.
+
+    If `instrumentation` is a ``bindingcalculator.Instrumentation``, the time,
+    rows, and peak memory of each stage are recorded in it, with the stages
+    for each study (including those in worker processes) prefixed by the study.
+
+    Example
+    -------
+    Only studies with changed inputs or unreadable cached data are rebuilt:
+
+    >>> import contextlib, io, tempfile, benchmark
+    >>> def process_rebuilt():
+    ...     with contextlib.redirect_stdout(io.StringIO()) as stdout:
+    ...         process_data(cache_dir='cache')
+    ...     return [line for line in stdout.getvalue().splitlines()
+    ...             if line.startswith('Rebuilt')]
+    >>> cwd = os.getcwd()
+    >>> with tempfile.TemporaryDirectory() as tmpdir:
+    ...     _ = benchmark.write_synthetic_data(tmpdir, n_studies=3, n_conditions=2,
+    ...                                        n_sites=3, n_mutations=2)
+    ...     os.chdir(tmpdir)
+    ...     try:
+    ...         print(process_rebuilt())
+    ...         print(process_rebuilt())
+    ...         with open('data/2022_Synthetic1_benchmark/study.yml', 'a') as f:
+    ...             _ = f.write('\\n')
+    ...         print(process_rebuilt())
+    ...         with open('cache/2022_Synthetic2_benchmark.pickle', 'wb') as f:
+    ...             _ = f.write(b'corrupt')
+    ...         print(process_rebuilt())
+    ...     finally:
+    ...         os.chdir(cwd)
+    ['Rebuilt 3 studies: 2022_Synthetic0_benchmark, 2022_Synthetic1_benchmark, 2022_Synthetic2_benchmark']
+    ['Rebuilt 0 studies: ']
+    ['Rebuilt 1 studies: 2022_Synthetic1_benchmark']
+    ['Rebuilt 1 studies: 2022_Synthetic2_benchmark']
+
+    """
     print(f"Processing data in {data_dir}...")
     merged_data = []
     studies = []
     subdirs = sorted(os.path.join(data_dir, d) for d in os.listdir(data_dir)
                      if os.path.isdir(os.path.join(data_dir, d)) and
                      not d.startswith('.'))
+
+    # read cached processed data from identical input files, building other studies
+    to_build = subdirs
+    hashes = {}
+    cached = {}
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        to_build = []
+        for subdir in subdirs:
+            prefix = os.path.join(cache_dir, os.path.basename(subdir))
+            hashes[subdir] = study_hash(subdir, study_yaml_base, data_csv_base)
+            cached_hash = None
+            if os.path.isfile(f"{prefix}.sha256") and os.path.isfile(f"{prefix}.pickle"):
+                with open(f"{prefix}.sha256") as f:
+                    cached_hash = f.read().strip()
+            if cached_hash == hashes[subdir]:
+                try:
+                    with instrumented_stage(instrumentation,
+                                            f"{os.path.basename(subdir)}: read_cache") as stage:
+                        cached[subdir] = pd.read_pickle(f"{prefix}.pickle")
+                        stage['rows'] = len(cached[subdir][2])
+                except Exception as e:  # unpickling can raise almost anything
+                    print(f"Cannot read cached {prefix}.pickle, rebuilding: {e!r}",
+                          file=sys.stderr)
+            if subdir not in cached:
+                to_build.append(subdir)
+
+    rebuilt = []
+    reused = []
+    study_results = iter_subdirs(
+        to_build, study_yaml_base, data_csv_base, processes,
+        instrument=instrumentation is not None,
+        trace_memory=instrumentation is not None and instrumentation.trace_memory,
+    )
     for i, subdir in enumerate(subdirs):
         print(f"  {i + 1}/{len(subdirs)}: {subdir}... ", end='')
-        study_yaml = os.path.join(subdir, study_yaml_base)
-        data_csv = os.path.join(subdir, data_csv_base)
-        for f in [study_yaml, data_csv]:
-            if not os.path.isfile(f):
-                raise IOError(f"Missing file {f}")
-        first_author, year, jrnl, url, lab, data = process_study(study_yaml,
-                                                                 data_csv)
-        # make sure directory has appropriate prefix / suffix
-        study = os.path.basename(subdir)
-        if not study.startswith(f"{year}_{first_author}_"):
-            raise ValueError(f"{subdir} should start with "
-                             f"{year}_{first_author} to reflect year "
-                             'and first author')
-        print(f"{study} has {data['condition'].nunique()} conditions")
-        data = data.assign(study=study,
-                           lab=lab)
+        if subdir in to_build:
+            study_info, n_conditions, data, records = next(study_results)
+            for record in records:
+                instrumentation.add({**record, 'stage': f"{study_info[0]}: {record['stage']}"})
+            rebuilt.append(study_info[0])
+            if cache_dir is not None:
+                prefix = os.path.join(cache_dir, study_info[0])
+                if os.path.isfile(f"{prefix}.sha256"):
+                    os.remove(f"{prefix}.sha256")
+                pd.to_pickle((study_info, n_conditions, data), f"{prefix}.pickle")
+                with open(f"{prefix}.sha256", 'w') as f:
+                    f.write(hashes[subdir])
+        else:
+            study_info, n_conditions, data = cached.pop(subdir)
+            reused.append(study_info[0])
+        study = study_info[0]
+        print(f"{study} has {n_conditions} conditions")
         if study in studies:
             raise ValueError(f"duplicate study {study}")
-        studies.append((study, first_author, year, jrnl, url, lab))
+        studies.append(study_info)
         merged_data.append(data)
-    merged_data = pd.concat(merged_data, ignore_index=True)
-
-    # ignore antibody cocktail data
-    merged_data = merged_data.query('condition_type != "antibody cocktail"')
-
-    # compute site-level escape
-    assert len(merged_data) == len(merged_data.groupby(['condition', 'study',
-                                                        'site', 'mutation'])) 
-    site_data = (
-        merged_data
-        .groupby(['condition', 'study', 'site'],
-                 as_index=False, dropna=False)
-        .aggregate(site_total_escape=pd.NamedAgg('mut_escape', 'sum'))
-        )
-
-    # Normalize site-level escape, first setting to one for each condition,
-    # and then further adjusting so that median value is at no greater than 0.5
-    limset = AxLimSetter(datalim_pad=0,
-                         min_upperlim=1,
-                         include_zero=True,
-                         max_from_quantile=(0.5, 0.05),
-                         )
-    assert len(site_data) == len(site_data.groupby(['condition', 'study', 'site']))
-    for col in ['site_total_escape']:
-        site_data[col] = site_data[col] / (site_data
-                                           .groupby(['condition', 'study'])
-                                           [col]
-                                           .transform('max')
-                                           )
-        site_data['norm_max'] = (site_data
-                                 .groupby(['condition', 'study'])
-                                 [col]
-                                 .transform(lambda s: limset.get_lims(s)[1])
-                                 )
-        site_data[col] = site_data[col] / site_data['norm_max']
-        site_data = site_data.drop(columns='norm_max')
-
-    # merge site data into data frame and add other `dms-view` columns
-    merged_data = (
-        merged_data
-        .merge(site_data)
-        .assign(label_site=lambda x: x['wildtype'] + x['site'].astype(str),
-                protein_site=lambda x: x['site'],
-                protein_chain='E',  # for PDB 6moj
-                )
-        )
+    study_results.close()  # shut down any worker processes
+    with instrumented_stage(instrumentation, 'concat') as stage:
+        merged_data = concat_categorical(merged_data)
+        stage['rows'] = len(merged_data)
+    if cache_dir is not None:
+        print(f"\nRebuilt {len(rebuilt)} studies: {', '.join(rebuilt)}")
+        print(f"Reused {len(reused)} studies from cache: {', '.join(reused)}")
 
     outdir = 'processed_data'
     os.makedirs(outdir, exist_ok=True)
     out_csv = os.path.join(outdir, 'escape_data.csv')
     print(f"\nWriting escape data to {out_csv}")
-    merged_data.to_csv(out_csv, index=False, float_format='%.4g')
+    with instrumented_stage(instrumentation, f"write {out_csv}") as stage:
+        merged_data.to_csv(out_csv, index=False, float_format='%.4g')
+        stage['rows'] = len(merged_data)
+    if parquet:
+        out_parquet = os.path.join(outdir, 'escape_data_parquet')
+        print(f"\nWriting escape data to Parquet dataset {out_parquet}")
+        with instrumented_stage(instrumentation, f"write {out_parquet}") as stage:
+            write_parquet(merged_data, out_parquet)
+            stage['rows'] = len(merged_data)
+    if sqlite:
+        out_sqlite = os.path.join(outdir, 'escape_data.sqlite')
+        print(f"\nWriting escape data to SQLite database {out_sqlite}")
+        with instrumented_stage(instrumentation, f"write {out_sqlite}") as stage:
+            write_sqlite(merged_data, out_sqlite)
+            stage['rows'] = len(merged_data)
+    if peak_memory_mb() is not None:
+        print(f"Peak memory usage: {peak_memory_mb():.0f} MB")
+    if processes > 1 and peak_memory_mb(children=True) is not None:
+        print(f"Peak memory usage of worker processes: "
+              f"{peak_memory_mb(children=True):.0f} MB")
 
     out_studies = os.path.join(outdir, 'studies.csv')
     print(f"\nWriting studies to {out_studies}")
@@ -228,7 +848,9 @@ def process_data(data_dir='data',
         .sort_values(['year', 'citation'])
         [['study', 'citation', 'url']]
         )
-    studies_df.to_csv(out_studies, index=False)
+    with instrumented_stage(instrumentation, f"write {out_studies}") as stage:
+        studies_df.to_csv(out_studies, index=False)
+        stage['rows'] = len(studies_df)
 
     # add studies to end of docs/index.md
     for md in ['docs/index.md', 'docs/escape-calc.md']:
@@ -254,6 +876,28 @@ def process_data(data_dir='data',
                 f.write(f"  - [{tup.citation}]({tup.url})\n")
 
 
-
 if __name__ == '__main__':
-    process_data()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of processes used to parse studies in parallel')
+    parser.add_argument('--cache-dir',
+                        help='cache processed studies here, only reprocessing changed ones')
+    parser.add_argument('--parquet', action='store_true',
+                        help='also write Parquet dataset partitioned by study')
+    parser.add_argument('--sqlite', action='store_true',
+                        help='also write indexed SQLite database')
+    parser.add_argument('--profile',
+                        help='write time, rows, and peak memory of each stage to this JSON file')
+    args = parser.parse_args()
+    instrumentation = Instrumentation() if args.profile else None
+    try:
+        process_data(processes=args.processes,
+                     cache_dir=args.cache_dir,
+                     parquet=args.parquet,
+                     sqlite=args.sqlite,
+                     instrumentation=instrumentation,
+                     )
+    finally:
+        if instrumentation is not None:
+            instrumentation.to_json(args.profile)
+            print(f"\nWrote profile of stages to {args.profile}")